@@ -0,0 +1,108 @@
+"""Script to benchmark the data transformation component on synthetic datasets."""
+
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+import typer
+
+from src.pipeline_components.data_transformation_component import (
+    data_transformation_component,
+)
+
+MOOD_IDS = (
+    "bonnehumeur",
+    "curiosite",
+    "detente",
+    "euphorie",
+    "reverie",
+    "victoire",
+    "colere",
+    "inquietude",
+    "nostalgie",
+    "panique",
+    "suspense",
+    "tristesse",
+)
+
+
+def make_synthetic_dataset(
+    directory: Path, num_rows: int, num_scripts: int, seed: int
+) -> tuple[Path, Path]:
+    """Write synthetic mood samples and catalog CSV files and return their paths."""
+    rng = random.Random(seed)
+    scripts = [
+        json.dumps(
+            [
+                {
+                    "rgb": [rng.randrange(256) for _ in range(3)],
+                    "duration": rng.randint(2, 16),
+                    "intensity": round(rng.uniform(0.1, 0.9), 2),
+                }
+                for _ in range(rng.randint(2, 4))
+            ]
+        )
+        for _ in range(num_scripts)
+    ]
+    mood_ids = [rng.choice(MOOD_IDS) for _ in range(num_rows)]
+    samples_path = directory / "mood_samples.csv"
+    pd.DataFrame(
+        {
+            "mood_id": mood_ids,
+            "user_text": [
+                f"Je me sens {mood_id} numero {index}"
+                for index, mood_id in enumerate(mood_ids)
+            ],
+            "lighting_script": [rng.choice(scripts) for _ in range(num_rows)],
+        }
+    ).to_csv(samples_path, index=False)
+
+    catalog_path = directory / "mood_catalog.csv"
+    pd.DataFrame(
+        {
+            "mood_id": MOOD_IDS,
+            "file_uri": [
+                f"gs://bucket/audio_previews/{mood_id}.mp3" for mood_id in MOOD_IDS
+            ],
+        }
+    ).to_csv(catalog_path, index=False)
+    return samples_path, catalog_path
+
+
+def benchmark_data_transformation(
+    sizes: str = "10000,100000,1000000",
+    num_scripts: int = 500,
+    seed: int = 0,
+    chunk_size: int = 0,
+    split_strategy: str = "stratified",
+):
+    """Time the data transformation component on synthetic datasets of each size.
+
+    A positive ``chunk_size`` benchmarks the streaming mode of the component.
+    """
+    for num_rows in (int(size) for size in sizes.split(",")):
+        with tempfile.TemporaryDirectory() as directory:
+            samples_path, catalog_path = make_synthetic_dataset(
+                Path(directory), num_rows, num_scripts, seed
+            )
+            start = time.perf_counter()
+            data_transformation_component.python_func(
+                raw_dataset_uri=str(samples_path),
+                mood_catalog_uri=str(catalog_path),
+                train_test_split_ratio=0.1,
+                train_dataset=str(Path(directory) / "train"),
+                test_dataset=str(Path(directory) / "test"),
+                chunk_size=chunk_size,
+                split_strategy=split_strategy,
+            )
+            elapsed = time.perf_counter() - start
+        print(
+            f"{num_rows:>9} rows: {elapsed:8.2f} s ({num_rows / elapsed:,.0f} rows/s)"
+        )
+
+
+if __name__ == "__main__":
+    typer.run(benchmark_data_transformation)
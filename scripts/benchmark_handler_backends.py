@@ -0,0 +1,123 @@
+"""Script to compare the latency, throughput and memory of handler backends."""
+
+import gc
+import os
+import statistics
+import time
+
+import torch
+import typer
+
+from src.handler import MODEL_DIR, EndpointHandler, resolve_serving_backend
+
+# Backend specs are "<device>[-<dtype>][-int8]", e.g. "cuda", "cpu-bfloat16".
+DEFAULT_BACKENDS = "cuda,cpu-float32,cpu-bfloat16,cpu-int8"
+SENTENCES = (
+    "Je me sens incroyablement positif ce matin et je veux une ambiance qui danse.",
+    "J'ai peur de rater mon examen demain, tout m'angoisse.",
+    "Je repense a mes vacances d'enfance chez ma grand-mere.",
+    "On vient de gagner le match en finale, c'est la folie !",
+    "Je suis fatigue et j'ai juste envie de me poser au calme.",
+    "Il se passe quelque chose d'etrange dans la maison ce soir.",
+    "Je ne comprends pas pourquoi il m'a menti, ca m'enerve.",
+    "Je flotte entre deux reves en regardant les etoiles.",
+)
+
+
+def parse_backend_spec(spec: str) -> dict[str, str]:
+    """Split a backend spec into ``resolve_serving_backend`` arguments."""
+    device, *options = spec.split("-")
+    quantization = "int8" if "int8" in options else "none"
+    dtypes = [option for option in options if option != "int8"]
+    return {
+        "device": device,
+        "dtype": dtypes[0] if dtypes else "auto",
+        "quantization": quantization,
+    }
+
+
+def resident_memory_bytes() -> int:
+    """Resident set size of the process, from ``/proc`` on Linux."""
+    with open("/proc/self/statm", encoding="ascii") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def benchmark_handler_backends(
+    model_dir: str = MODEL_DIR,
+    backends: str = DEFAULT_BACKENDS,
+    num_requests: int = 16,
+    max_new_tokens: int = 128,
+    num_threads: int = 0,
+):
+    """Load the handler on each backend and time single and batched requests.
+
+    Latency is measured on ``num_requests`` sequential one-instance requests and
+    throughput on a single request holding all of them, with greedy decoding. Memory
+    is the growth of the resident set size while loading on CPU, or the peak CUDA
+    allocation on GPU. Backends that cannot run on this machine are skipped.
+    """
+    prompts = [
+        f"<|user|>\n{SENTENCES[index % len(SENTENCES)]}<|end|>\n<|assistant|>\n"
+        for index in range(num_requests)
+    ]
+    parameters = {"max_new_tokens": max_new_tokens, "do_sample": False}
+    for spec in backends.split(","):
+        try:
+            backend = resolve_serving_backend(
+                **parse_backend_spec(spec), num_threads=num_threads
+            )
+        except ValueError as exc:
+            print(f"{spec:>22}: skipped ({exc})")
+            continue
+
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats()
+        memory_before = resident_memory_bytes()
+        start = time.perf_counter()
+        handler = EndpointHandler(model_dir, scheduler="none", backend=backend)
+        load_time = time.perf_counter() - start
+        memory = (
+            torch.cuda.max_memory_allocated()
+            if backend.device.startswith("cuda")
+            else resident_memory_bytes() - memory_before
+        )
+
+        handler({"instances": [{"input": prompts[0]}], "parameters": parameters})
+        latencies = []
+        for prompt in prompts:
+            start = time.perf_counter()
+            handler({"instances": [{"input": prompt}], "parameters": parameters})
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        outputs = handler(
+            {
+                "instances": [{"input": prompt} for prompt in prompts],
+                "parameters": parameters,
+            }
+        )["predictions"]
+        batch_time = time.perf_counter() - start
+        p95 = statistics.quantiles(latencies, n=20)[-1] if num_requests > 1 else 0.0
+        # Outputs hold the prompt followed by the generated tokens.
+        num_tokens = sum(
+            len(handler.tokenizer(output, add_special_tokens=False)["input_ids"])
+            - len(handler.tokenizer(prompt, add_special_tokens=False)["input_ids"])
+            for prompt, output in zip(prompts, outputs, strict=True)
+        )
+
+        print(
+            f"{backend.name:>22}: load {load_time:6.1f} s,"
+            f" memory {memory / 2**30:5.2f} GiB,"
+            f" latency p50 {statistics.median(latencies) * 1000:7.0f} ms"
+            f" p95 {p95 * 1000:7.0f} ms,"
+            f" throughput {len(prompts) / batch_time:6.2f} req/s"
+            f" {num_tokens / batch_time:7.1f} tokens/s"
+        )
+        del handler
+        gc.collect()
+
+
+if __name__ == "__main__":
+    typer.run(benchmark_handler_backends)
@@ -0,0 +1,98 @@
+"""Script to check and time speculative decoding against greedy decoding."""
+
+import statistics
+import time
+
+import typer
+
+from src.handler import (
+    DEVICE,
+    DRAFT_MODEL,
+    DTYPE,
+    MODEL_DIR,
+    NUM_DRAFT_TOKENS,
+    EndpointHandler,
+    resolve_serving_backend,
+)
+
+SENTENCES = (
+    "Je me sens incroyablement positif ce matin et je veux une ambiance qui danse.",
+    "J'ai peur de rater mon examen demain, tout m'angoisse.",
+    "Je repense a mes vacances d'enfance chez ma grand-mere.",
+    "On vient de gagner le match en finale, c'est la folie !",
+    "Je suis fatigue et j'ai juste envie de me poser au calme.",
+    "Il se passe quelque chose d'etrange dans la maison ce soir.",
+    "Je ne comprends pas pourquoi il m'a menti, ca m'enerve.",
+    "Je flotte entre deux reves en regardant les etoiles.",
+)
+
+
+def benchmark_speculative_decoding(
+    model_dir: str = MODEL_DIR,
+    speculative: str = "ngram",
+    draft_model: str | None = DRAFT_MODEL,
+    num_draft_tokens: int = NUM_DRAFT_TOKENS,
+    num_requests: int = 8,
+    max_new_tokens: int = 256,
+    *,
+    constrained_json: bool = False,
+    device: str = DEVICE,
+    dtype: str = DTYPE,
+):
+    """Decode each prompt greedily with and without speculation and compare.
+
+    Exits with status 1 when a speculative output differs from the greedy one. The
+    per-request latencies of both paths and the speculation counters are printed.
+    """
+    handler = EndpointHandler(
+        model_dir,
+        scheduler="none",
+        backend=resolve_serving_backend(device, dtype),
+        speculative=speculative,
+        draft_model=draft_model,
+        num_draft_tokens=num_draft_tokens,
+    )
+    prompts = [
+        handler.tokenizer.apply_chat_template(
+            [{"role": "user", "content": SENTENCES[index % len(SENTENCES)]}],
+            tokenize=False,
+            add_generation_prompt=True,
+        )
+        for index in range(num_requests)
+    ]
+    parameters = {
+        "max_new_tokens": max_new_tokens,
+        "constrained_json": constrained_json,
+    }
+    handler.generate(prompts[0], speculative=False, **parameters)
+
+    latencies: dict[bool, list[float]] = {False: [], True: []}
+    mismatches = 0
+    for prompt in prompts:
+        outputs = {}
+        for speculative_call in (False, True):
+            start = time.perf_counter()
+            outputs[speculative_call] = handler.generate(
+                prompt, speculative=speculative_call, **parameters
+            )
+            latencies[speculative_call].append(time.perf_counter() - start)
+        if outputs[True] != outputs[False]:
+            mismatches += 1
+            print(f"Mismatch for {prompt!r}:\n{outputs[False]!r}\n{outputs[True]!r}")
+
+    greedy = statistics.mean(latencies[False])
+    speculated = statistics.mean(latencies[True])
+    print(f"greedy      {greedy * 1000:8.0f} ms per request")
+    print(
+        f"speculative {speculated * 1000:8.0f} ms per request"
+        f" ({greedy / speculated:.2f}x faster)"
+    )
+    for name, value in handler.stats()["speculation"].items():
+        print(f"{name:>24}: {value:g}")
+    print(f"{mismatches} of {len(prompts)} outputs differ from greedy decoding")
+    if mismatches:
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    typer.run(benchmark_speculative_decoding)
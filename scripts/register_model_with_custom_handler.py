@@ -5,7 +5,13 @@ from pathlib import Path
 import typer
 from google.cloud import aiplatform, storage
 
-from src.constants import BUCKET_NAME, PROJECT_ID, PROJECT_ROOT_PATH, REGION
+from src.constants import (
+    BUCKET_NAME,
+    MOOD_CATALOG_URI,
+    PROJECT_ID,
+    PROJECT_ROOT_PATH,
+    REGION,
+)
 
 HANDLER_PATH = PROJECT_ROOT_PATH / "src" / "handler.py"
 
@@ -16,19 +22,32 @@ def register_model_with_custom_handler(
     parent_model: str | None = None,
     serving_container_image_uri: str = "us-docker.pkg.dev/deeplearning-platform-release/gcr.io/huggingface-pytorch-inference-cu121.2-3.transformers.4-46.ubuntu2204.py311",
     handler_path: Path = HANDLER_PATH,
+    mood_catalog_uri: str | None = MOOD_CATALOG_URI,
 ):
     """Registers a model with a custom handler in Vertex AI."""
     aiplatform.init(project=PROJECT_ID, location=REGION)
 
     # Upload the custom handler to GCS
-    blob_path = "/".join(model_uri.split("/")[3:]) + "/handler.py"
+    model_prefix = "/".join(model_uri.split("/")[3:])
+    client = storage.Client()
     (
-        storage.Client()
-        .bucket(BUCKET_NAME)
-        .blob(blob_path)
+        client.bucket(BUCKET_NAME)
+        .blob(f"{model_prefix}/handler.py")
         .upload_from_filename(str(handler_path))
     )
 
+    # Ship the mood catalog used by the handler's catalog serving mode
+    if mood_catalog_uri:
+        catalog_bucket_name, catalog_blob_name = mood_catalog_uri.removeprefix(
+            "gs://"
+        ).split("/", 1)
+        catalog_bucket = client.bucket(catalog_bucket_name)
+        catalog_bucket.copy_blob(
+            catalog_bucket.blob(catalog_blob_name),
+            client.bucket(BUCKET_NAME),
+            f"{model_prefix}/mood_catalog.csv",
+        )
+
     # Register the model with the custom handler
     aiplatform.Model.upload(
         display_name=display_name,
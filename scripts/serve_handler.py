@@ -0,0 +1,119 @@
+"""Script to serve the custom handler locally, with token streaming."""
+
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+import typer
+
+from src.handler import (
+    DEVICE,
+    DRAFT_MODEL,
+    DTYPE,
+    MODEL_DIR,
+    NUM_DRAFT_TOKENS,
+    NUM_THREADS,
+    QUANTIZATION,
+    SCHEDULER,
+    SPECULATIVE,
+    EndpointHandler,
+    resolve_serving_backend,
+)
+
+
+def make_request_handler(
+    endpoint_handler: EndpointHandler,
+) -> type[BaseHTTPRequestHandler]:
+    """Build the HTTP request handler class bound to an ``EndpointHandler``."""
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        """Serve ``/predict`` like Vertex AI, ``/stream`` as SSE and ``/stats``."""
+
+        def _read_json(self) -> dict[str, Any]:
+            """Read the JSON request body."""
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def _send_json(self, status: int, body: dict[str, Any]) -> None:
+            """Send a complete JSON response."""
+            content = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def _send_event(self, event: str, data: dict[str, Any]) -> None:
+            """Write one server-sent event and flush it to the client."""
+            self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+            self.wfile.flush()
+
+        def do_GET(self) -> None:
+            """Report the serving backend and speculative decoding counters."""
+            if self.path == "/stats":
+                self._send_json(200, endpoint_handler.stats())
+            else:
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self) -> None:
+            """Dispatch prediction requests."""
+            if self.path == "/predict":
+                self._send_json(200, endpoint_handler(self._read_json()))
+            elif self.path == "/stream":
+                self._stream(self._read_json())
+            else:
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+        def _stream(self, data: dict[str, Any]) -> None:
+            """Stream the generation of the first instance as server-sent events."""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            try:
+                for text in endpoint_handler.stream(
+                    data["instances"][0]["input"], **data.get("parameters", {})
+                ):
+                    if text:
+                        self._send_event("token", {"text": text})
+            except Exception as exc:  # pylint: disable=broad-except
+                self._send_event("error", {"error": str(exc)})
+                return
+            self._send_event("done", {})
+
+    return RequestHandler
+
+
+def serve_handler(
+    model_dir: str = MODEL_DIR,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    scheduler: str = SCHEDULER,
+    device: str = DEVICE,
+    dtype: str = DTYPE,
+    quantization: str = QUANTIZATION,
+    num_threads: int = NUM_THREADS,
+    speculative: str = SPECULATIVE,
+    draft_model: str | None = DRAFT_MODEL,
+    num_draft_tokens: int = NUM_DRAFT_TOKENS,
+):
+    """Serve the custom handler on a local HTTP server."""
+    backend = resolve_serving_backend(device, dtype, quantization, num_threads)
+    endpoint_handler = EndpointHandler(
+        model_dir,
+        scheduler=scheduler,
+        backend=backend,
+        speculative=speculative,
+        draft_model=draft_model,
+        num_draft_tokens=num_draft_tokens,
+    )
+    server = ThreadingHTTPServer((host, port), make_request_handler(endpoint_handler))
+    print(
+        f"Serving {model_dir} on {backend.name} at http://{host}:{port}"
+        " (/predict, /stream, /stats)"
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    typer.run(serve_handler)
@@ -0,0 +1,185 @@
+"""Process-wide cache of the audio previews stored on Cloud Storage."""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+
+from google.cloud import storage
+
+logger = logging.getLogger(__name__)
+
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", str(128 * 2**20)))
+AUDIO_CACHE_TTL_S = float(os.getenv("AUDIO_CACHE_TTL_S", "3600"))
+# Preview URIs of the training data whose blob was uploaded under another name.
+AUDIO_BLOB_OVERRIDES = {
+    "audio_previews/Bonnehumeur.mp3": "audio_previews/BonneHumeur.mp3",
+    "audio_previews/Tristess.mp3": "audio_previews/Tristesse.mp3",
+}
+
+BlobKey = tuple[str, str]
+
+
+def parse_gcs_uri(uri: str) -> BlobKey:
+    """Split a ``gs://bucket/blob`` URI into its bucket and blob names."""
+    path = uri.removeprefix("gs://")
+    if not uri.startswith("gs://") or "/" not in path:
+        raise ValueError(f"Not a Cloud Storage blob URI: {uri}")
+    bucket_name, blob_name = path.split("/", 1)
+    return bucket_name, blob_name
+
+
+@dataclass
+class CachedAudio:
+    """Bytes of a blob with the etag they were downloaded at."""
+
+    data: bytes
+    etag: str | None
+    validated_at: float
+
+
+class AudioCache:
+    """Thread-safe LRU cache of blob contents bounded by their total size.
+
+    Entries are keyed by the canonical blob, after resolving ``overrides`` once per
+    URI, so aliases of a track share one entry. Entries older than ``ttl_s`` are
+    revalidated against the blob etag and only downloaded again when it changed.
+    Concurrent misses on the same blob wait for a single download. Blobs larger than
+    ``max_bytes`` are returned without being cached.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = AUDIO_CACHE_MAX_BYTES,
+        ttl_s: float = AUDIO_CACHE_TTL_S,
+        overrides: dict[str, str] | None = None,
+        client: storage.Client | None = None,
+    ) -> None:
+        """Configure the cache; the storage client is created on first use."""
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.overrides = AUDIO_BLOB_OVERRIDES if overrides is None else overrides
+        self._client = client
+        self._entries: OrderedDict[BlobKey, CachedAudio] = OrderedDict()
+        self._size = 0
+        self._resolved: dict[BlobKey, BlobKey] = {}
+        self._inflight: dict[BlobKey, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    @property
+    def client(self) -> storage.Client:
+        """Cloud Storage client, created on first access."""
+        if self._client is None:
+            self._client = storage.Client()
+        return self._client
+
+    def resolve(self, uri: str) -> BlobKey:
+        """Return the canonical blob of a URI, checking the blob exists only once."""
+        key = parse_gcs_uri(uri)
+        with self._lock:
+            resolved = self._resolved.get(key)
+        if resolved is None:
+            bucket_name, blob_name = key
+            canonical_name = self.overrides.get(blob_name, blob_name)
+            if canonical_name != blob_name:
+                if self.client.bucket(bucket_name).blob(blob_name).exists():
+                    canonical_name = blob_name
+            resolved = (bucket_name, canonical_name)
+            with self._lock:
+                self._resolved[key] = resolved
+        return resolved
+
+    def get(self, uri: str) -> bytes:
+        """Return the contents of the blob behind ``uri``, downloading it if needed."""
+        return self.fetch(uri).data
+
+    def fetch(self, uri: str) -> CachedAudio:
+        """Return the cached blob behind ``uri`` with its etag."""
+        key = self.resolve(uri)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.validated_at < self.ttl_s:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            future = self._inflight.get(key)
+            downloading = future is not None
+            if not downloading:
+                future = self._inflight[key] = Future()
+        if downloading:
+            return future.result()
+
+        try:
+            fetched = self._load(key, entry)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(fetched)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return fetched
+
+    def stats(self) -> dict[str, int]:
+        """Counters describing the cache usage."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+            }
+
+    def _load(self, key: BlobKey, stale: CachedAudio | None) -> CachedAudio:
+        """Revalidate a stale entry or download the blob, then store it."""
+        bucket_name, blob_name = key
+        blob = self.client.bucket(bucket_name).blob(blob_name)
+        if stale is not None and stale.etag is not None:
+            blob.reload()
+            if blob.etag == stale.etag:
+                with self._lock:
+                    self.revalidations += 1
+                    stale.validated_at = time.monotonic()
+                return stale
+        data = blob.download_as_bytes()
+        logger.info(
+            "Downloaded gs://%s/%s (%d bytes)", bucket_name, blob_name, len(data)
+        )
+        fetched = CachedAudio(data, blob.etag, time.monotonic())
+        self._store(key, fetched)
+        return fetched
+
+    def _store(self, key: BlobKey, entry: CachedAudio) -> None:
+        """Insert an entry and evict the least recently used ones over the limit."""
+        with self._lock:
+            self.misses += 1
+            if (previous := self._entries.pop(key, None)) is not None:
+                self._size -= len(previous.data)
+            if len(entry.data) > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._size += len(entry.data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.data)
+
+
+_audio_cache: AudioCache | None = None
+_audio_cache_lock = threading.Lock()
+
+
+def get_audio_cache() -> AudioCache:
+    """Return the audio cache shared by every session of the process."""
+    global _audio_cache
+    with _audio_cache_lock:
+        if _audio_cache is None:
+            _audio_cache = AudioCache()
+        return _audio_cache
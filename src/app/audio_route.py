@@ -0,0 +1,189 @@
+"""Local static route serving the audio previews with range and cache support."""
+
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+from collections.abc import Iterator
+from pathlib import Path, PurePosixPath
+
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, StreamingResponse
+
+from src.app.audio_cache import AudioCache, get_audio_cache, parse_gcs_uri
+
+AUDIO_ROUTE_PREFIX = "/audio-previews"
+AUDIO_LOCAL_DIR = Path(os.getenv("AUDIO_LOCAL_DIR", "audio"))
+AUDIO_DISK_CACHE_DIR = Path(
+    os.getenv(
+        "AUDIO_DISK_CACHE_DIR",
+        os.path.join(tempfile.gettempdir(), "synesthetic_dj_audio"),
+    )
+)
+CHUNK_SIZE = 64 * 2**10
+# File names are content addressed, so browsers never need to revalidate them.
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+_RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+class AudioFileStore:
+    """Map preview URIs to files served by the audio route.
+
+    A preview is served from ``local_dir`` when a file with the blob name (or its
+    override) exists there, and is otherwise written to ``cache_dir`` from the
+    ``AudioCache``. Published names derive from the blob etag or the file stat, so a
+    name always refers to the same bytes and doubles as the ETag.
+    """
+
+    def __init__(
+        self,
+        cache: AudioCache | None = None,
+        local_dir: Path = AUDIO_LOCAL_DIR,
+        cache_dir: Path = AUDIO_DISK_CACHE_DIR,
+    ) -> None:
+        """Configure the store; nothing is downloaded until a URI is published."""
+        self.cache = cache or get_audio_cache()
+        self.local_dir = local_dir
+        self.cache_dir = cache_dir
+        self._files: dict[str, Path] = {}
+        self._lock = threading.Lock()
+
+    def publish(self, uri: str) -> str:
+        """Make the preview behind ``uri`` available and return its URL path."""
+        local_file = self._local_file(uri)
+        if local_file is not None:
+            stat = local_file.stat()
+            name = _file_name(f"{local_file}:{stat.st_size}:{stat.st_mtime_ns}", uri)
+            path = local_file
+        else:
+            fetched = self.cache.fetch(uri)
+            bucket_name, blob_name = self.cache.resolve(uri)
+            version = fetched.etag or hashlib.blake2b(fetched.data).hexdigest()
+            name = _file_name(f"{bucket_name}/{blob_name}:{version}", uri)
+            path = self.cache_dir / name
+            if not path.exists():
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                partial = path.with_name(f"{name}.{threading.get_ident()}.part")
+                partial.write_bytes(fetched.data)
+                os.replace(partial, path)
+        with self._lock:
+            self._files[name] = path
+        return f"{AUDIO_ROUTE_PREFIX}/{name}"
+
+    def path(self, name: str) -> Path | None:
+        """Return the file published under ``name``, if any."""
+        with self._lock:
+            return self._files.get(name)
+
+    def _local_file(self, uri: str) -> Path | None:
+        """Find the preview in the local audio directory without calling GCS."""
+        _, blob_name = parse_gcs_uri(uri)
+        for candidate in (blob_name, self.cache.overrides.get(blob_name, blob_name)):
+            path = self.local_dir / PurePosixPath(candidate).name
+            if path.is_file():
+                return path
+        return None
+
+
+def _file_name(version: str, uri: str) -> str:
+    """Content-addressed file name keeping the extension of the blob."""
+    digest = hashlib.blake2b(version.encode(), digest_size=12).hexdigest()
+    return digest + (PurePosixPath(uri).suffix or ".mp3")
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """Parse a single-range ``Range`` header into inclusive byte offsets.
+
+    Returns ``None`` when the header is malformed or asks for several ranges, in
+    which case the whole file is served.
+
+    Raises:
+        ValueError: If the range cannot be satisfied.
+    """
+    match = _RANGE_PATTERN.fullmatch(header.strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError(f"Unsatisfiable range {header} for {size} bytes")
+    return start, end
+
+
+def _iter_file(path: Path, start: int, end: int) -> Iterator[bytes]:
+    """Read ``path`` from ``start`` to ``end`` inclusive in chunks."""
+    with path.open("rb") as file:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def serve_audio(store: AudioFileStore, request: Request, name: str) -> Response:
+    """Serve a published file honouring ``If-None-Match`` and ``Range``."""
+    path = store.path(name)
+    if path is None or not path.is_file():
+        return Response(status_code=404)
+
+    size = path.stat().st_size
+    etag = f'"{PurePosixPath(name).stem}"'
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    start, end, status = 0, size - 1, 200
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            (start, end), status = byte_range, 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    headers["Content-Length"] = str(end - start + 1)
+    media_type = mimetypes.guess_type(name)[0] or "audio/mpeg"
+    if request.method == "HEAD" or size == 0:
+        return Response(status_code=status, headers=headers, media_type=media_type)
+    return StreamingResponse(
+        _iter_file(path, start, end),
+        status_code=status,
+        headers=headers,
+        media_type=media_type,
+    )
+
+
+def mount_audio_route(app: FastAPI, store: AudioFileStore) -> None:
+    """Register the audio route ahead of the catch-all route of the frontend."""
+
+    @app.api_route(f"{AUDIO_ROUTE_PREFIX}/{{name}}", methods=["GET", "HEAD"])
+    def audio_preview(request: Request, name: str) -> Response:
+        return serve_audio(store, request, name)
+
+    app.router.routes.insert(0, app.router.routes.pop())
+
+
+_audio_file_store: AudioFileStore | None = None
+_audio_file_store_lock = threading.Lock()
+
+
+def get_audio_file_store() -> AudioFileStore:
+    """Return the audio file store shared by every session of the process."""
+    global _audio_file_store
+    with _audio_file_store_lock:
+        if _audio_file_store is None:
+            _audio_file_store = AudioFileStore()
+        return _audio_file_store
@@ -0,0 +1,154 @@
+"""Cached access tokens for calling the Vertex AI endpoint."""
+
+import logging
+import subprocess
+import threading
+import time
+from collections.abc import Callable
+from datetime import UTC
+
+logger = logging.getLogger(__name__)
+
+# A token source returns an access token and its expiry as a UNIX timestamp.
+TokenSource = Callable[[], tuple[str, float]]
+
+CLOUD_PLATFORM_SCOPE = "https://www.googleapis.com/auth/cloud-platform"
+REFRESH_MARGIN_S = 300.0
+RETRY_DELAY_S = 30.0
+# gcloud does not report the expiry of the tokens it prints.
+GCLOUD_TOKEN_LIFETIME_S = 900.0
+
+
+def gcloud_token_source() -> tuple[str, float]:
+    """Fetch a token from the gcloud CLI."""
+    token = subprocess.check_output(
+        ["gcloud", "auth", "print-access-token"], text=True
+    ).strip()
+    return token, time.time() + GCLOUD_TOKEN_LIFETIME_S
+
+
+class GoogleAuthTokenSource:
+    """Token source backed by Application Default Credentials.
+
+    Falls back to ``gcloud_token_source`` when no default credentials are found.
+    """
+
+    def __init__(self) -> None:
+        """Defer credential discovery to the first call."""
+        self._credentials = None
+        self._use_gcloud = False
+
+    def __call__(self) -> tuple[str, float]:
+        """Refresh the default credentials and return their token."""
+        if self._use_gcloud:
+            return gcloud_token_source()
+
+        import google.auth
+        from google.auth.exceptions import DefaultCredentialsError
+        from google.auth.transport.requests import Request
+
+        if self._credentials is None:
+            try:
+                self._credentials, _ = google.auth.default(
+                    scopes=[CLOUD_PLATFORM_SCOPE]
+                )
+            except DefaultCredentialsError:
+                logger.info("No default credentials, using gcloud tokens")
+                self._use_gcloud = True
+                return gcloud_token_source()
+        self._credentials.refresh(Request())
+        expiry = (
+            self._credentials.expiry.replace(tzinfo=UTC).timestamp()
+            if self._credentials.expiry
+            else time.time() + GCLOUD_TOKEN_LIFETIME_S
+        )
+        return self._credentials.token, expiry
+
+
+class AccessTokenProvider:
+    """Thread-safe access token cache refreshed in the background.
+
+    The token is fetched from ``source`` on first use, then refreshed by a daemon
+    timer ``refresh_margin_s`` seconds before it expires, so callers normally get the
+    cached token without waiting. If a background refresh fails it is retried every
+    ``RETRY_DELAY_S`` seconds, and ``get_token`` refreshes synchronously once the
+    cached token is within the margin.
+    """
+
+    def __init__(
+        self,
+        source: TokenSource | None = None,
+        refresh_margin_s: float = REFRESH_MARGIN_S,
+        *,
+        background_refresh: bool = True,
+    ) -> None:
+        """Configure the provider without fetching a token yet."""
+        self._source = source or GoogleAuthTokenSource()
+        self.refresh_margin_s = refresh_margin_s
+        self.background_refresh = background_refresh
+        self._token: str | None = None
+        self._expiry = 0.0
+        self._lock = threading.Lock()
+        self._timer: threading.Timer | None = None
+
+    def get_token(self) -> str:
+        """Return a token valid for at least the refresh margin."""
+        with self._lock:
+            expires_soon = time.time() >= self._expiry - self.refresh_margin_s
+            if self._token is None or expires_soon:
+                self._refresh()
+            assert self._token is not None
+            return self._token
+
+    def close(self) -> None:
+        """Stop refreshing the token in the background."""
+        with self._lock:
+            self.background_refresh = False
+            if self._timer is not None:
+                self._timer.cancel()
+
+    def _refresh(self) -> None:
+        """Fetch a new token and schedule the next refresh; the lock must be held."""
+        self._token, self._expiry = self._source()
+        self._schedule(self._expiry - self.refresh_margin_s - time.time())
+
+    def _schedule(self, delay_s: float) -> None:
+        """Schedule a background refresh in ``delay_s`` seconds."""
+        if self._timer is not None:
+            self._timer.cancel()
+        if not self.background_refresh:
+            return
+        self._timer = threading.Timer(max(delay_s, 1.0), self._refresh_in_background)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refresh_in_background(self) -> None:
+        """Timer callback refreshing the token ahead of its expiry."""
+        with self._lock:
+            try:
+                self._refresh()
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.warning("Background token refresh failed: %s", exc)
+                self._schedule(RETRY_DELAY_S)
+
+
+_token_provider: AccessTokenProvider | None = None
+_token_provider_lock = threading.Lock()
+
+
+def get_token_provider() -> AccessTokenProvider:
+    """Return the token provider shared by every session of the process."""
+    global _token_provider
+    with _token_provider_lock:
+        if _token_provider is None:
+            _token_provider = AccessTokenProvider()
+        return _token_provider
+
+
+def set_token_provider(provider: AccessTokenProvider) -> None:
+    """Replace the shared token provider, e.g. with one backed by a fake source."""
+    global _token_provider
+    with _token_provider_lock:
+        if _token_provider is not None:
+            _token_provider.close()
+        _token_provider = provider
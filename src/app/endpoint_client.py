@@ -0,0 +1,138 @@
+"""Async, pooled HTTP client for the model prediction endpoints."""
+
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import random
+from collections.abc import AsyncIterator
+from typing import Any
+
+import httpx
+
+from src.app.credentials import AccessTokenProvider
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENCY = int(os.getenv("ENDPOINT_MAX_CONCURRENCY", "8"))
+MAX_CONNECTIONS = int(os.getenv("ENDPOINT_MAX_CONNECTIONS", "20"))
+TIMEOUT_S = float(os.getenv("ENDPOINT_TIMEOUT_S", "30"))
+CONNECT_TIMEOUT_S = 5.0
+MAX_RETRIES = int(os.getenv("ENDPOINT_MAX_RETRIES", "3"))
+RETRY_BASE_DELAY_S = 0.5
+RETRY_MAX_DELAY_S = 8.0
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+class AsyncEndpointClient:
+    """Prediction client sharing one connection pool between chat sessions.
+
+    Connections are kept alive and negotiated over HTTP/2 when the ``h2`` package is
+    installed. At most ``max_concurrency`` requests are in flight at once; the others
+    wait for a slot without blocking the event loop. Transport errors and retryable
+    status codes are retried up to ``max_retries`` times with exponential backoff
+    and full jitter.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        token_provider: AccessTokenProvider | None = None,
+        max_concurrency: int = MAX_CONCURRENCY,
+        max_connections: int = MAX_CONNECTIONS,
+        timeout_s: float = TIMEOUT_S,
+        max_retries: int = MAX_RETRIES,
+    ) -> None:
+        """Configure the client; connections are opened on first use."""
+        self.url = url
+        self.token_provider = token_provider
+        self.max_retries = max_retries
+        self._limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections
+        )
+        self._timeout = httpx.Timeout(timeout_s, connect=CONNECT_TIMEOUT_S)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Underlying ``httpx`` client, created in the running event loop."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=importlib.util.find_spec("h2") is not None,
+                limits=self._limits,
+                timeout=self._timeout,
+            )
+        return self._client
+
+    async def predict(
+        self, instances: list[dict[str, Any]], parameters: dict[str, Any]
+    ) -> dict[str, Any]:
+        """Send a prediction request and return the decoded JSON response."""
+        body = {"instances": instances, "parameters": parameters}
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = await self.client.post(
+                        self.url, json=body, headers=await self._headers()
+                    )
+                except httpx.TransportError as exc:
+                    if attempt == self.max_retries:
+                        raise
+                    logger.warning("Endpoint request failed (%s), retrying", exc)
+                else:
+                    if (
+                        response.status_code not in RETRYABLE_STATUS_CODES
+                        or attempt == self.max_retries
+                    ):
+                        response.raise_for_status()
+                        return response.json()
+                    logger.warning(
+                        "Endpoint answered %d, retrying", response.status_code
+                    )
+                await self._backoff(attempt)
+        raise AssertionError("unreachable")
+
+    async def stream(
+        self, instances: list[dict[str, Any]], parameters: dict[str, Any]
+    ) -> AsyncIterator[str]:
+        """Yield text chunks from a server-sent events prediction stream."""
+        body = {"instances": instances, "parameters": parameters}
+        async with (
+            self._semaphore,
+            self.client.stream(
+                "POST", self.url, json=body, headers=await self._headers()
+            ) as response,
+        ):
+            response.raise_for_status()
+            event = "token"
+            async for line in response.aiter_lines():
+                if line.startswith("event:"):
+                    event = line.removeprefix("event:").strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line.removeprefix("data:"))
+                    if event == "error":
+                        raise RuntimeError(data["error"])
+                    if event == "done":
+                        return
+                    yield data["text"]
+
+    async def aclose(self) -> None:
+        """Close the pooled connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _headers(self) -> dict[str, str]:
+        """Authorization headers, fetching the token off the event loop."""
+        if self.token_provider is None:
+            return {}
+        token = await asyncio.to_thread(self.token_provider.get_token)
+        return {"Authorization": f"Bearer {token}"}
+
+    @staticmethod
+    async def _backoff(attempt: int) -> None:
+        """Sleep for a random delay bounded by an exponentially growing cap."""
+        cap = min(RETRY_MAX_DELAY_S, RETRY_BASE_DELAY_S * 2**attempt)
+        await asyncio.sleep(random.uniform(0, cap))
@@ -0,0 +1,382 @@
+"""Compiled lighting animations shared between responses."""
+
+import base64
+import binascii
+import hashlib
+import logging
+import math
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import Any
+
+import numpy as np
+from fastapi import FastAPI
+from fastapi.responses import Response
+
+logger = logging.getLogger(__name__)
+
+LIGHTING_ROUTE_PREFIX = "/lighting"
+LIGHTING_CACHE_SIZE = 4096
+DEFAULT_INTENSITY = 0.5
+# Stylesheet URLs hold the cues they are compiled from, so browsers never need to
+# revalidate them and any process can compile them again on a cache miss.
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Registered custom properties are interpolated between keyframes, so each response
+# only animates a handful of variables used by the rules below.
+BASE_STYLESHEET = (
+    "@property --syn-bg { syntax: '<color>'; inherits: true;"
+    " initial-value: transparent; }"
+    "@property --syn-glow { syntax: '<color>'; inherits: true;"
+    " initial-value: transparent; }"
+    "@property --syn-glow-size { syntax: '<length>'; inherits: true;"
+    " initial-value: 80px; }"
+    "@property --syn-glow-opacity { syntax: '<number>'; inherits: true;"
+    " initial-value: 0; }"
+    "@property --syn-beam { syntax: '<color>'; inherits: true;"
+    " initial-value: transparent; }"
+    "@property --syn-beam-angle { syntax: '<angle>'; inherits: true;"
+    " initial-value: 0deg; }"
+    "@property --syn-beam-opacity { syntax: '<number>'; inherits: true;"
+    " initial-value: 0; }"
+    "#synesthetic-dj-lighting {"
+    "position: fixed; top: 0; left: 0; width: 100%; height: 100%;"
+    "pointer-events: none; z-index: -2; overflow: hidden;"
+    "background: radial-gradient(circle at 50% 50%, var(--syn-bg) 0%,"
+    " rgba(0, 0, 0, 0.1) 65%, rgba(0, 0, 0, 0.6) 100%);"
+    "background-size: cover;"
+    "animation-timing-function: ease-in-out, ease-in-out, linear;"
+    "animation-iteration-count: infinite;"
+    "}"
+    "#synesthetic-dj-lighting .syn-layer {"
+    "position: absolute; inset: -25%; mix-blend-mode: screen;"
+    "}"
+    "#synesthetic-dj-lighting .syn-glow {"
+    "box-shadow: 0 0 var(--syn-glow-size) var(--syn-glow);"
+    "opacity: var(--syn-glow-opacity);"
+    "border-radius: 45%; filter: blur(80px);"
+    "}"
+    "#synesthetic-dj-lighting .syn-beam {"
+    "background: conic-gradient(from var(--syn-beam-angle), var(--syn-beam) 15%,"
+    " transparent 60%);"
+    "opacity: var(--syn-beam-opacity);"
+    "filter: blur(45px);"
+    "}"
+)
+BASE_STYLESHEET_NAME = (
+    f"base-{hashlib.blake2b(BASE_STYLESHEET.encode(), digest_size=8).hexdigest()}.css"
+)
+
+CUE_DTYPE = np.dtype(
+    [
+        ("rgb", np.uint8, (3,)),
+        ("duration", np.float64),
+        ("intensity", np.float64),
+        ("integral_duration", np.bool_),
+    ]
+)
+
+
+def rgb_to_hex(rgb: Sequence[int]) -> str:
+    """Convert RGB list to hex color."""
+    return f"#{rgb[0]:02x}{rgb[1]:02x}{rgb[2]:02x}"
+
+
+def rgb_to_rgba(rgb: Sequence[int], alpha: float) -> str:
+    """Convert RGB list to rgba() string with bounded alpha."""
+    bounded_alpha = max(0.0, min(alpha, 1.0))
+    return f"rgba({rgb[0]}, {rgb[1]}, {rgb[2]}, {bounded_alpha:.2f})"
+
+
+def clamp_alpha(
+    alpha: np.ndarray, minimum: float = 0.0, maximum: float = 1.0
+) -> np.ndarray:
+    """Bound alpha values element-wise."""
+    return np.clip(alpha, minimum, maximum)
+
+
+def rgba_strings(rgb: np.ndarray, alpha: np.ndarray) -> list[str]:
+    """Format rows of RGB values and their alpha as rgba() strings."""
+    return [
+        f"rgba({red}, {green}, {blue}, {bounded_alpha:.2f})"
+        for (red, green, blue), bounded_alpha in zip(
+            rgb.tolist(), clamp_alpha(alpha).tolist(), strict=True
+        )
+    ]
+
+
+def _is_number(value: Any) -> bool:
+    """Whether ``value`` is a JSON number, booleans excluded."""
+    return isinstance(value, int | float) and not isinstance(value, bool)
+
+
+def _check_cue(light: Any) -> None:
+    """Check the fields of a cue before they are stored in ``CUE_DTYPE``.
+
+    Raises:
+        ValueError: If a field is missing or of the wrong type.
+    """
+    if not isinstance(light, dict):
+        raise ValueError(f"Invalid lighting cue: {light!r}")
+    rgb = light.get("rgb")
+    if not (
+        isinstance(rgb, list)
+        and len(rgb) == 3
+        and all(
+            isinstance(c, int) and not isinstance(c, bool) and 0 <= c <= 255
+            for c in rgb
+        )
+    ):
+        raise ValueError(f"Invalid lighting color: {rgb!r}")
+    if not _is_number(light.get("duration")):
+        raise ValueError(f"Invalid lighting duration: {light.get('duration')!r}")
+    if "intensity" in light and not _is_number(light["intensity"]):
+        raise ValueError(f"Invalid lighting intensity: {light['intensity']!r}")
+
+
+class LightingScript:
+    """Lighting cues stored in a NumPy structured array of ``CUE_DTYPE``.
+
+    Missing intensities are stored as NaN and durations written as JSON integers are
+    flagged, so ``to_json`` returns the script the object was built from.
+    """
+
+    __slots__ = ("cues",)
+
+    def __init__(self, cues: np.ndarray) -> None:
+        """Wrap an array of ``CUE_DTYPE``."""
+        self.cues = cues
+
+    def __len__(self) -> int:
+        """Number of cues."""
+        return len(self.cues)
+
+    @classmethod
+    def from_json(cls, lighting: list[dict[str, Any]]) -> "LightingScript":
+        """Build a script from the ``lighting`` list of an assistant payload.
+
+        Colors must hold three integers from 0 to 255 and durations and intensities
+        must be numbers, so that no value is silently coerced.
+
+        Raises:
+            ValueError: If a cue misses a field or has a field of the wrong type.
+        """
+        try:
+            for light in lighting:
+                _check_cue(light)
+            cues = np.empty(len(lighting), dtype=CUE_DTYPE)
+            durations = [light["duration"] for light in lighting]
+            cues["rgb"] = [light["rgb"] for light in lighting]
+            cues["duration"] = durations
+            cues["intensity"] = [light.get("intensity", np.nan) for light in lighting]
+            cues["integral_duration"] = [isinstance(d, int) for d in durations]
+        except (KeyError, TypeError, ValueError, OverflowError) as exc:
+            raise ValueError(f"Invalid lighting script: {exc!r}") from exc
+        return cls(cues)
+
+    def to_json(self) -> list[dict[str, Any]]:
+        """Return the ``lighting`` list of an assistant payload."""
+        lighting = []
+        for rgb, duration, intensity, integral_duration in self.cues.tolist():
+            light = {
+                "rgb": rgb.tolist(),
+                "duration": int(duration) if integral_duration else duration,
+            }
+            if not math.isnan(intensity):
+                light["intensity"] = intensity
+            lighting.append(light)
+        return lighting
+
+    @classmethod
+    def from_url_token(cls, token: str) -> "LightingScript":
+        """Build a script from the output of ``to_url_token``.
+
+        Raises:
+            ValueError: If ``token`` does not encode whole cues.
+        """
+        try:
+            data = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        except binascii.Error as exc:
+            raise ValueError(f"Invalid lighting token: {exc!r}") from exc
+        if not data or len(data) % CUE_DTYPE.itemsize:
+            raise ValueError("Invalid lighting token: truncated cues")
+        return cls(np.frombuffer(data, dtype=CUE_DTYPE).copy())
+
+    def to_url_token(self) -> str:
+        """Encode the cues as unpadded URL-safe base64."""
+        return base64.urlsafe_b64encode(self.cues.tobytes()).decode().rstrip("=")
+
+    @property
+    def key(self) -> str:
+        """Hash of the cues, identical for scripts with the same cues."""
+        return hashlib.blake2b(self.cues.tobytes(), digest_size=8).hexdigest()
+
+    def intensities(self) -> np.ndarray:
+        """Intensity of each cue, defaulting missing ones."""
+        intensity = self.cues["intensity"]
+        return np.where(np.isnan(intensity), DEFAULT_INTENSITY, intensity)
+
+    def total_duration(self) -> float:
+        """Duration of one loop of the script, at least one second if empty."""
+        return float(self.cues["duration"].sum()) or 1.0
+
+    def keyframe_percentages(self) -> np.ndarray:
+        """Start of each cue as a percentage of the total duration."""
+        starts = np.concatenate(([0.0], np.cumsum(self.cues["duration"])[:-1]))
+        return starts / self.total_duration() * 100
+
+
+def compile_keyframes(script: LightingScript, name: str) -> str:
+    """Build the stylesheet animating the base variables through ``script``."""
+    # The animation loops back to the first cue with the beam on a full turn.
+    order = np.append(np.arange(len(script)), 0)
+    rgb = script.cues["rgb"][order]
+    intensity = script.intensities()[order]
+    percentages = np.append(script.keyframe_percentages(), 100.0)
+    offsets = [f"{percentage:.1f}%" for percentage in percentages[:-1].tolist()]
+    offsets.append("100%")
+
+    backgrounds = rgba_strings(rgb, clamp_alpha(intensity + 0.15, 0.25, 0.85))
+    glows = rgba_strings(rgb, np.minimum(intensity + 0.2, 0.75))
+    glow_sizes = (80 + np.trunc(intensity * 140)).astype(int).tolist()
+    glow_opacities = np.minimum(intensity + 0.15, 0.8).tolist()
+    beams = rgba_strings(rgb, np.minimum(intensity + 0.05, 0.55))
+    beam_angles = (percentages * 3.6).tolist()
+    beam_opacities = np.minimum(intensity + 0.05, 0.45).tolist()
+
+    background = " ".join(
+        f"{at} {{ --syn-bg: {color}; }}"
+        for at, color in zip(offsets, backgrounds, strict=True)
+    )
+    glow = " ".join(
+        f"{at} {{ --syn-glow: {color}; --syn-glow-size: {size}px;"
+        f" --syn-glow-opacity: {opacity:.2f}; }}"
+        for at, color, size, opacity in zip(
+            offsets, glows, glow_sizes, glow_opacities, strict=True
+        )
+    )
+    beam = " ".join(
+        f"{at} {{ --syn-beam: {color}; --syn-beam-angle: {angle:.1f}deg;"
+        f" --syn-beam-opacity: {opacity:.2f}; }}"
+        for at, color, angle, opacity in zip(
+            offsets, beams, beam_angles, beam_opacities, strict=True
+        )
+    )
+    return (
+        f"@keyframes {name}-bg {{{background}}}"
+        f"@keyframes {name}-glow {{{glow}}}"
+        f"@keyframes {name}-beam {{{beam}}}"
+        f"#synesthetic-dj-lighting[data-palette='{name}'] {{"
+        f"animation-name: {name}-bg, {name}-glow, {name}-beam;"
+        f"animation-duration: {script.total_duration()}s;"
+        "}"
+    )
+
+
+class LightingRenderer:
+    """Render lighting scripts as a small snippet linking cached stylesheets.
+
+    The rules shared by every animation live in ``BASE_STYLESHEET``. Each distinct
+    sequence of cues is compiled into a stylesheet holding only its keyframes, named
+    after a hash of the cues, so a response ships a few hundred bytes of HTML and
+    browsers reuse the stylesheets of palettes they have already seen. The cues are
+    encoded in the stylesheet URL, so the LRU cache of compiled stylesheets only
+    saves work: after an eviction, a restart or on another replica, the stylesheet
+    is compiled again from its URL.
+    """
+
+    def __init__(self, max_palettes: int = LIGHTING_CACHE_SIZE) -> None:
+        """Configure an empty palette cache."""
+        self.max_palettes = max_palettes
+        self._stylesheets: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, lighting: list[dict[str, Any]]) -> str:
+        """Return the HTML of the lighting overlay, or an empty string.
+
+        Invalid scripts are logged and rendered as an empty string, so that the rest
+        of the response is still shown.
+        """
+        if not lighting:
+            return ""
+        try:
+            script = LightingScript.from_json(lighting)
+        except ValueError as exc:
+            logger.warning("Skipping lighting: %s", exc)
+            return ""
+        name = self.compile(script)
+        return (
+            f"<link rel='stylesheet' href='{LIGHTING_ROUTE_PREFIX}/"
+            f"{BASE_STYLESHEET_NAME}'>"
+            f"<link rel='stylesheet' href='{LIGHTING_ROUTE_PREFIX}/"
+            f"{name}.{script.to_url_token()}.css'>"
+            f"<div id='synesthetic-dj-lighting' data-palette='{name}'>"
+            "<div class='syn-layer syn-glow'></div>"
+            "<div class='syn-layer syn-beam'></div>"
+            "</div>"
+        )
+
+    def compile(self, script: LightingScript) -> str:
+        """Compile the stylesheet of ``script`` if needed and return its name."""
+        name = f"synDj{script.key}"
+        self._compile(script, name)
+        return name
+
+    def _compile(self, script: LightingScript, name: str) -> str:
+        """Return the stylesheet named ``name``, compiling it on a cache miss."""
+        with self._lock:
+            if name in self._stylesheets:
+                self._stylesheets.move_to_end(name)
+                return self._stylesheets[name]
+        stylesheet = compile_keyframes(script, name)
+        with self._lock:
+            self._stylesheets[name] = stylesheet
+            while len(self._stylesheets) > self.max_palettes:
+                self._stylesheets.popitem(last=False)
+        return stylesheet
+
+    def stylesheet(self, filename: str) -> str | None:
+        """Return the stylesheet served under ``filename``, if any.
+
+        Stylesheets missing from the cache are compiled from the cues encoded in
+        ``filename``, provided they match the palette name it starts with.
+        """
+        if filename == BASE_STYLESHEET_NAME:
+            return BASE_STYLESHEET
+        name, _, token = filename.removesuffix(".css").partition(".")
+        try:
+            script = LightingScript.from_url_token(token)
+        except ValueError:
+            return None
+        if name != f"synDj{script.key}":
+            return None
+        return self._compile(script, name)
+
+
+def mount_lighting_route(app: FastAPI, renderer: LightingRenderer) -> None:
+    """Register the stylesheet route ahead of the catch-all route of the frontend."""
+
+    @app.get(f"{LIGHTING_ROUTE_PREFIX}/{{filename}}")
+    def lighting_stylesheet(filename: str) -> Response:
+        stylesheet = renderer.stylesheet(filename)
+        if stylesheet is None:
+            return Response(status_code=404)
+        return Response(
+            stylesheet, media_type="text/css", headers={"Cache-Control": CACHE_CONTROL}
+        )
+
+    app.router.routes.insert(0, app.router.routes.pop())
+
+
+_lighting_renderer: LightingRenderer | None = None
+_lighting_renderer_lock = threading.Lock()
+
+
+def get_lighting_renderer() -> LightingRenderer:
+    """Return the lighting renderer shared by every session of the process."""
+    global _lighting_renderer
+    with _lighting_renderer_lock:
+        if _lighting_renderer is None:
+            _lighting_renderer = LightingRenderer()
+        return _lighting_renderer
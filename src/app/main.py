@@ -1,21 +1,23 @@
 """Chainlit app integrating a custom LLM chat model API."""
 
 import re
-import subprocess
 
 import chainlit as cl
-import requests
 from chainlit.message import Message
 from langfuse import Langfuse, observe
-from transformers import AutoTokenizer
 
+from src.app.credentials import get_token_provider
+from src.app.endpoint_client import AsyncEndpointClient
+from src.app.prompting import get_prompt_builder
+from src.app.response_cache import get_response_cache
 from src.constants import ENDPOINT_ID, PROJECT_NUMBER
 
-MODEL_REPO_ID = "microsoft/Phi-3-mini-4k-instruct"
 ENDPOINT_URL = f"https://europe-west2-aiplatform.googleapis.com/v1/projects/{PROJECT_NUMBER}/locations/europe-west2/endpoints/{ENDPOINT_ID}:predict"
 
 
 langfuse = Langfuse(blocked_instrumentation_scopes=["chainlit"])
+endpoint_client = AsyncEndpointClient(ENDPOINT_URL, get_token_provider())
+response_cache = get_response_cache()
 
 
 @cl.set_starters  # type: ignore
@@ -40,18 +42,11 @@ async def set_starters():
 @cl.on_message
 async def handle_message(message: Message):
     """Handle incoming messages from the user."""
-    await cl.Message(content=call_model_api(message)).send()
-
-
-def build_prompt(tokenizer: AutoTokenizer, sentence: str):
-    """Build a prompt from a sentence applying the chat template."""
-    return tokenizer.apply_chat_template(  # type: ignore
-        [
-            {"role": "user", "content": sentence},
-        ],
-        tokenize=False,
-        add_generation_prompt=True,
-    )
+    answer = response_cache.get(message.content)
+    if answer is None:
+        answer = await call_model_api(message)
+        response_cache.put(message.content, answer)
+    await cl.Message(content=answer).send()
 
 
 def extract_response(generated_text: str) -> str:
@@ -63,18 +58,12 @@ def extract_response(generated_text: str) -> str:
 
 
 @observe(name="User Message")
-def call_model_api(message: Message) -> str:
+async def call_model_api(message: Message) -> str:
     """Call the custom LLM chat model API."""
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_REPO_ID)
-
-    access_token = subprocess.check_output(
-        ["gcloud", "auth", "print-access-token"], text=True
-    ).strip()
-
     langfuse.update_current_span(input=message.content)
 
     with langfuse.start_as_current_generation(name="Yoda LLM Generation") as gen:
-        templated_input = build_prompt(tokenizer, message.content)
+        templated_input = get_prompt_builder().build(message.content)
         model_input = {
             "instances": [{"input": templated_input}],
             "parameters": {
@@ -83,14 +72,9 @@ def call_model_api(message: Message) -> str:
                 "topP": 0.8,
             },
         }
-        response = requests.post(
-            ENDPOINT_URL,
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json",
-            },
-            json=model_input,
-        ).json()
+        response = await endpoint_client.predict(
+            model_input["instances"], model_input["parameters"]
+        )
         raw_model_response = response["predictions"][0]
 
         gen.update(
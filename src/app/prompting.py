@@ -0,0 +1,75 @@
+"""Process-wide prompt building shared by the Chainlit apps."""
+
+import os
+import threading
+from functools import lru_cache
+from typing import Any
+
+MODEL_REPO_ID = "microsoft/Phi-3-mini-4k-instruct"
+PHI3_FAST_TEMPLATE = os.getenv("PHI3_FAST_TEMPLATE", "false").lower() == "true"
+PROMPT_CACHE_SIZE = 4096
+
+
+def render_phi3_prompt(sentence: str) -> str:
+    """Render the Phi-3 chat template for a single user turn without a tokenizer."""
+    return f"<|user|>\n{sentence}<|end|>\n<|assistant|>\n"
+
+
+class PromptBuilder:
+    """Build chat prompts with a tokenizer loaded at most once.
+
+    The tokenizer is loaded lazily, under a lock, the first time a prompt is rendered
+    with it, and rendered prompts are kept in an LRU cache. With ``fast_template``,
+    prompts are rendered by ``render_phi3_prompt`` and the tokenizer (and
+    ``transformers``) is never loaded.
+    """
+
+    def __init__(
+        self,
+        model_repo_id: str = MODEL_REPO_ID,
+        *,
+        fast_template: bool = PHI3_FAST_TEMPLATE,
+        cache_size: int = PROMPT_CACHE_SIZE,
+    ) -> None:
+        """Configure the builder without loading anything yet."""
+        self.model_repo_id = model_repo_id
+        self.fast_template = fast_template
+        self._tokenizer: Any = None
+        self._lock = threading.Lock()
+        self.build = lru_cache(maxsize=cache_size)(self._render)
+
+    @property
+    def tokenizer(self) -> Any:
+        """Tokenizer of the served model, loaded on first access."""
+        if self._tokenizer is None:
+            with self._lock:
+                if self._tokenizer is None:
+                    from transformers import AutoTokenizer
+
+                    self._tokenizer = AutoTokenizer.from_pretrained(self.model_repo_id)
+        return self._tokenizer
+
+    def _render(self, sentence: str) -> str:
+        """Build a prompt from a sentence applying the chat template."""
+        if self.fast_template:
+            return render_phi3_prompt(sentence)
+        return self.tokenizer.apply_chat_template(
+            [
+                {"role": "user", "content": sentence},
+            ],
+            tokenize=False,
+            add_generation_prompt=True,
+        )
+
+
+_prompt_builder: PromptBuilder | None = None
+_prompt_builder_lock = threading.Lock()
+
+
+def get_prompt_builder() -> PromptBuilder:
+    """Return the prompt builder shared by every session of the process."""
+    global _prompt_builder
+    with _prompt_builder_lock:
+        if _prompt_builder is None:
+            _prompt_builder = PromptBuilder()
+        return _prompt_builder
@@ -0,0 +1,118 @@
+"""Process-wide cache of model responses keyed by the user message."""
+
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+# Jaccard similarity of character n-grams above which a message reuses the response
+# of a previous one. Unset disables the near-duplicate layer.
+_similarity = os.getenv("RESPONSE_CACHE_SIMILARITY")
+RESPONSE_CACHE_SIMILARITY: float | None = float(_similarity) if _similarity else None
+NGRAM_SIZE = 3
+_PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+
+
+def normalize_message(text: str) -> str:
+    """Case-fold, strip accents and punctuation, and collapse whitespace."""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(_PUNCTUATION_PATTERN.sub(" ", text).split())
+
+
+def char_ngrams(text: str, size: int = NGRAM_SIZE) -> frozenset[str]:
+    """Character n-grams of a normalized message, padded with spaces."""
+    padded = f" {text} "
+    return frozenset(padded[i : i + size] for i in range(len(padded) - size + 1))
+
+
+def jaccard_similarity(first: frozenset[str], second: frozenset[str]) -> float:
+    """Size of the intersection of two sets over the size of their union."""
+    if not first or not second:
+        return 0.0
+    shared = len(first & second)
+    return shared / (len(first) + len(second) - shared)
+
+
+class ResponseCache:
+    """Thread-safe LRU cache of responses with an optional near-duplicate layer.
+
+    Messages are looked up by their normalized text first. When
+    ``similarity_threshold`` is set and the exact lookup misses, the cached message
+    whose character n-grams are the most similar is reused if its Jaccard
+    similarity reaches the threshold. Near-duplicate lookups scan every entry, which
+    stays cheap at the sizes the app uses.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_SIZE,
+        similarity_threshold: float | None = RESPONSE_CACHE_SIMILARITY,
+        ngram_size: int = NGRAM_SIZE,
+    ) -> None:
+        """Configure an empty cache."""
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.ngram_size = ngram_size
+        self._entries: OrderedDict[str, tuple[frozenset[str], Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def get(self, message: str) -> Any | None:
+        """Return the response cached for ``message`` or a near duplicate of it."""
+        key = normalize_message(message)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][1]
+            if self.similarity_threshold is not None:
+                ngrams = char_ngrams(key, self.ngram_size)
+                best_key, best_similarity = None, self.similarity_threshold
+                for cached_key, (cached_ngrams, _) in self._entries.items():
+                    similarity = jaccard_similarity(ngrams, cached_ngrams)
+                    if similarity >= best_similarity:
+                        best_key, best_similarity = cached_key, similarity
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.near_hits += 1
+                    return self._entries[best_key][1]
+            self.misses += 1
+            return None
+
+    def put(self, message: str, response: Any) -> None:
+        """Cache the response of ``message``, evicting the least recently used."""
+        key = normalize_message(message)
+        with self._lock:
+            self._entries[key] = (char_ngrams(key, self.ngram_size), response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        """Counters describing the cache usage."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+            }
+
+
+_response_cache: ResponseCache | None = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the response cache shared by every session of the process."""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+        return _response_cache
@@ -1,33 +1,74 @@
 """Chainlit app for Synesthetic DJ with audio and lighting effects."""
 
+import asyncio
 import json
 import re
-import subprocess
-from typing import Optional
 
 import chainlit as cl
-import requests
 from chainlit.message import Message
-from google.cloud import storage
-from transformers import AutoTokenizer
+from chainlit.server import app as chainlit_app
 
-from src.constants import ENDPOINT_ID, PROJECT_NUMBER, REGION
+from src.app.audio_route import get_audio_file_store, mount_audio_route
+from src.app.credentials import get_token_provider
+from src.app.endpoint_client import AsyncEndpointClient
+from src.app.lighting import get_lighting_renderer, mount_lighting_route
+from src.app.prompting import get_prompt_builder
+from src.app.response_cache import get_response_cache
+from src.app.warmup import get_catalog_warmup, mount_warmup_route
+from src.constants import ENDPOINT_ID, PROJECT_NUMBER, REGION, STREAM_ENDPOINT_URL
 
-MODEL_REPO_ID = "microsoft/Phi-3-mini-4k-instruct"
 ENDPOINT_URL = f"https://{REGION}-aiplatform.googleapis.com/v1/projects/{PROJECT_NUMBER}/locations/{REGION}/endpoints/{ENDPOINT_ID}:predict"
-_storage_client: Optional[storage.Client] = None
-_AUDIO_BLOB_OVERRIDES = {
-    "audio_previews/Bonnehumeur.mp3": "audio_previews/BonneHumeur.mp3",
-    "audio_previews/Tristess.mp3": "audio_previews/Tristesse.mp3",
+MODEL_PARAMETERS = {
+    "max_new_tokens": 256,
+    "temperature": 0.1,
+    "top_p": 0.8,
 }
+_endpoint_client: AsyncEndpointClient | None = None
+_stream_client: AsyncEndpointClient | None = None
+_STREAMED_FIELD_PATTERNS = {
+    "mood_id": re.compile(r'"mood_id":\s*"([^"]*)"'),
+    "preview_uri": re.compile(r'"preview_uri":\s*"([^"]*)"'),
+}
+FRIENDLY_NAMES = {
+    "bonnehumeur": "bonne humeur",
+    "curiosite": "curiosite",
+    "detente": "detente",
+    "euphorie": "euphorie",
+    "reverie": "reverie",
+    "victoire": "victoire",
+    "colere": "colere",
+    "inquietude": "inquietude",
+    "nostalgie": "nostalgie",
+    "panique": "panique",
+    "suspense": "suspense",
+    "tristesse": "tristesse",
+}
+
+
+mount_audio_route(chainlit_app, get_audio_file_store())
+mount_lighting_route(chainlit_app, get_lighting_renderer())
+mount_warmup_route(chainlit_app, get_catalog_warmup())
+# Chainlit versions without an app startup hook import this module at startup.
+if hasattr(cl, "on_app_startup"):
+    cl.on_app_startup(get_catalog_warmup().start)
+else:
+    get_catalog_warmup().start()
+
 
+def get_endpoint_client() -> AsyncEndpointClient:
+    """Lazily instantiate the pooled client of the Vertex AI endpoint."""
+    global _endpoint_client
+    if _endpoint_client is None:
+        _endpoint_client = AsyncEndpointClient(ENDPOINT_URL, get_token_provider())
+    return _endpoint_client
 
-def _get_storage_client() -> storage.Client:
-    """Lazily instantiate the Cloud Storage client."""
-    global _storage_client  # noqa: PLW0603
-    if _storage_client is None:
-        _storage_client = storage.Client()
-    return _storage_client
+
+def get_stream_client() -> AsyncEndpointClient:
+    """Lazily instantiate the pooled client of the local streaming server."""
+    global _stream_client
+    if _stream_client is None:
+        _stream_client = AsyncEndpointClient(STREAM_ENDPOINT_URL)
+    return _stream_client
 
 
 @cl.set_starters  # type: ignore
@@ -53,17 +94,6 @@ async def set_starters():
     ]
 
 
-def build_prompt(tokenizer: AutoTokenizer, sentence: str) -> str:
-    """Build a prompt from a sentence applying the chat template."""
-    return tokenizer.apply_chat_template(  # type: ignore
-        [
-            {"role": "user", "content": sentence},
-        ],
-        tokenize=False,
-        add_generation_prompt=True,
-    )
-
-
 def extract_json_response(generated_text: str) -> dict:
     """Extract and parse JSON response from the generated text."""
     # Extract JSON between <|assistant|> and <|end|>
@@ -79,154 +109,72 @@ def extract_json_response(generated_text: str) -> dict:
     raise ValueError("Could not extract JSON from response")
 
 
-def call_model_api(message: str) -> dict:
+async def call_model_api(message: str) -> dict:
     """Call the Synesthetic DJ model API."""
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_REPO_ID)
-
-    access_token = subprocess.check_output(
-        ["gcloud", "auth", "print-access-token"], text=True
-    ).strip()
-
-    templated_input = build_prompt(tokenizer, message)
-    model_input = {
-        "instances": [{"input": templated_input}],
-        "parameters": {
-            "max_new_tokens": 256,
-            "temperature": 0.1,
-            "top_p": 0.8,
-        },
-    }
-
-    response = requests.post(
-        ENDPOINT_URL,
-        headers={
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json",
-        },
-        json=model_input,
-        timeout=30,
-    ).json()
+    templated_input = get_prompt_builder().build(message)
+    response = await get_endpoint_client().predict(
+        [{"input": templated_input}], MODEL_PARAMETERS
+    )
 
     raw_response = response["predictions"][0]
     return extract_json_response(raw_response)
 
 
-def rgb_to_hex(rgb: list[int]) -> str:
-    """Convert RGB list to hex color."""
-    return "#{:02x}{:02x}{:02x}".format(rgb[0], rgb[1], rgb[2])
-
-
-def rgb_to_rgba(rgb: list[int], alpha: float) -> str:
-    """Convert RGB list to rgba() string with bounded alpha."""
-    bounded_alpha = max(0.0, min(alpha, 1.0))
-    return f"rgba({rgb[0]}, {rgb[1]}, {rgb[2]}, {bounded_alpha:.2f})"
-
-
-def create_lighting_animation_html(lighting: list[dict]) -> str:
-    """Create an immersive lighting animation overlay."""
-    if not lighting:
-        return ""
-
-    background_frames: list[str] = []
-    glow_frames: list[str] = []
-    beam_frames: list[str] = []
-    total_duration = sum(light["duration"] for light in lighting) or 1.0
-    current_time = 0.0
-
-    for light in lighting:
-        percentage = (current_time / total_duration) * 100
-        color = light["rgb"]
-        intensity = float(light.get("intensity", 0.5))
-        background_frames.append(
-            f"{percentage:.1f}% {{ "
-            f"background: radial-gradient(circle at 50% 50%, {rgb_to_rgba(color, min(0.85, max(0.25, intensity + 0.15)))} 0%, "
-            "rgba(0, 0, 0, 0.1) 65%, rgba(0, 0, 0, 0.6) 100%); }}"
-        )
-        glow_frames.append(
-            f"{percentage:.1f}% {{ "
-            f"box-shadow: 0 0 {80 + int(intensity * 140)}px {rgb_to_rgba(color, min(0.75, intensity + 0.2))}; "
-            f"opacity: {min(0.8, intensity + 0.15):.2f}; }}"
-        )
-        beam_frames.append(
-            f"{percentage:.1f}% {{ "
-            f"background: conic-gradient(from {percentage * 3.6:.1f}deg, {rgb_to_rgba(color, min(0.55, intensity + 0.05))} 15%, transparent 60%); "
-            f"opacity: {min(0.45, intensity + 0.05):.2f}; }}"
+class PayloadStreamParser:
+    """Incrementally pick fields out of a streamed JSON payload."""
+
+    def __init__(self) -> None:
+        """Start with an empty stream."""
+        self.text = ""
+        self.fields: dict[str, str] = {}
+
+    def feed(self, chunk: str) -> dict[str, str]:
+        """Append a chunk and return the fields completed by it."""
+        self.text += chunk
+        completed = {}
+        for name, pattern in _STREAMED_FIELD_PATTERNS.items():
+            if name not in self.fields and (match := pattern.search(self.text)):
+                self.fields[name] = completed[name] = match.group(1)
+        return completed
+
+
+async def stream_model_api(message: str, loading_msg: cl.Message) -> tuple[dict, dict]:
+    """Stream the prediction and play the track as soon as it is decoded.
+
+    The track is loaded while the rest of the payload is decoded and sent in its own
+    message once loaded. Returns the parsed response and the ``cl.Audio`` keyword
+    arguments left to send, empty when the track was already sent.
+    """
+    templated_input = get_prompt_builder().build(message)
+
+    parser = PayloadStreamParser()
+    audio_task: asyncio.Task | None = None
+    async for chunk in get_stream_client().stream(
+        [{"input": templated_input}], MODEL_PARAMETERS
+    ):
+        completed = parser.feed(chunk)
+        if "mood_id" in completed:
+            ambiance = FRIENDLY_NAMES.get(completed["mood_id"], completed["mood_id"])
+            loading_msg.content = (
+                f"🎶 Ambiance {ambiance} détectée, préparation de la lumière..."
+            )
+            await loading_msg.update()
+        if "preview_uri" in completed:
+            audio_task = asyncio.create_task(send_audio(completed["preview_uri"]))
+
+    response = extract_json_response(templated_input + parser.text)
+    if audio_task is None:
+        return response, await asyncio.to_thread(
+            load_audio_content, response["track"]["preview_uri"]
         )
-        current_time += light["duration"]
-
-    first_light = lighting[0]
-    first_color = first_light["rgb"]
-    first_intensity = float(first_light.get("intensity", 0.5))
-    background_frames.append(
-        "100% { "
-        f"background: radial-gradient(circle at 50% 50%, {rgb_to_rgba(first_color, min(0.85, max(0.25, first_intensity + 0.15)))} 0%, "
-        "rgba(0, 0, 0, 0.1) 65%, rgba(0, 0, 0, 0.6) 100%); }}"
-    )
-    glow_frames.append(
-        "100% { "
-        f"box-shadow: 0 0 {80 + int(first_intensity * 140)}px {rgb_to_rgba(first_color, min(0.75, first_intensity + 0.2))}; "
-        f"opacity: {min(0.8, first_intensity + 0.15):.2f}; }}"
-    )
-    beam_frames.append(
-        "100% { "
-        f"background: conic-gradient(from 360deg, {rgb_to_rgba(first_color, min(0.55, first_intensity + 0.05))} 15%, transparent 60%); "
-        f"opacity: {min(0.45, first_intensity + 0.05):.2f}; }}"
-    )
-
-    return (
-        "<style>"
-        "@keyframes synDjBackground {"
-        + " ".join(background_frames)
-        + "}"
-        "@keyframes synDjGlow {"
-        + " ".join(glow_frames)
-        + "}"
-        "@keyframes synDjBeam {"
-        + " ".join(beam_frames)
-        + "}"
-        "#synesthetic-dj-lighting {"
-        "position: fixed; top: 0; left: 0; width: 100%; height: 100%;"
-        "pointer-events: none; z-index: -2; overflow: hidden;"
-        f"animation: synDjBackground {total_duration}s ease-in-out infinite;"
-        "background-size: cover;"
-        "}"
-        "#synesthetic-dj-lighting .syn-layer {"
-        "position: absolute; inset: -25%; mix-blend-mode: screen;"
-        "}"
-        "#synesthetic-dj-lighting .syn-glow {"
-        f"animation: synDjGlow {total_duration}s ease-in-out infinite;"
-        "border-radius: 45%; filter: blur(80px);"
-        "}"
-        "#synesthetic-dj-lighting .syn-beam {"
-        f"animation: synDjBeam {total_duration}s linear infinite;"
-        "filter: blur(45px);"
-        "}"
-        "</style>"
-        "<div id='synesthetic-dj-lighting'>"
-        "<div class='syn-layer syn-glow'></div>"
-        "<div class='syn-layer syn-beam'></div>"
-        "</div>"
-    )
+    await audio_task
+    return response, {}
 
 
 def format_confirmation(response: dict) -> str:
     """Generate a concise confirmation sentence for the user."""
-    friendly_names = {
-        "bonnehumeur": "bonne humeur",
-        "curiosite": "curiosite",
-        "detente": "detente",
-        "euphorie": "euphorie",
-        "reverie": "reverie",
-        "victoire": "victoire",
-        "colere": "colere",
-        "inquietude": "inquietude",
-        "nostalgie": "nostalgie",
-        "panique": "panique",
-        "suspense": "suspense",
-        "tristesse": "tristesse",
-    }
     mood_id = response["track"]["mood_id"]
-    ambiance = friendly_names.get(mood_id, mood_id)
+    ambiance = FRIENDLY_NAMES.get(mood_id, mood_id)
     narration = response.get(
         "narration", "Ambiance personnalisee en cours, laisse-toi porter."
     )
@@ -239,30 +187,35 @@ def load_audio_content(url: str) -> dict:
         return {}
 
     if url.startswith("gs://"):
-        path = url.removeprefix("gs://")
-        if "/" not in path:
+        if "/" not in url.removeprefix("gs://"):
             return {}
-        bucket_name, blob_name = path.split("/", 1)
-        canonical_blob_name = _AUDIO_BLOB_OVERRIDES.get(blob_name, blob_name)
         try:
-            client = _get_storage_client()
-            bucket = client.bucket(bucket_name)
-            blob = bucket.blob(blob_name)
-            if not blob.exists():
-                blob = bucket.blob(canonical_blob_name)
-            data = blob.download_as_bytes()
-            return {"content": data, "mime": "audio/mpeg"}
+            return {"url": get_audio_file_store().publish(url), "mime": "audio/mpeg"}
         except Exception as exc:  # pylint: disable=broad-except
-            cl.logger.error("Failed to download audio %s (canonical %s): %s", url, canonical_blob_name, exc)
+            cl.logger.error("Failed to download audio %s: %s", url, exc)
             return {}
 
     return {"url": url, "mime": "audio/mpeg"}
 
 
+def audio_element(audio_kwargs: dict) -> cl.Audio:
+    """Build the auto-playing audio element of the ambiance."""
+    return cl.Audio(
+        name="ambiance-audio", auto_play=True, display="inline", **audio_kwargs
+    )
+
+
+async def send_audio(url: str) -> None:
+    """Load the track at ``url`` and send it in a message of its own."""
+    audio_kwargs = await asyncio.to_thread(load_audio_content, url)
+    if audio_kwargs:
+        await cl.Message(content="", elements=[audio_element(audio_kwargs)]).send()
+
+
 @cl.on_chat_start
 async def start():
     """Initialize the chat session."""
-    return None
+    get_catalog_warmup().start()
 
 
 @cl.on_message
@@ -273,8 +226,23 @@ async def handle_message(message: Message):
     await loading_msg.send()
 
     try:
-        # Call the model
-        response = call_model_api(message.content)
+        # Reuse the response of a previous identical or similar message, or call
+        # the model, streaming when a streaming server is configured
+        response = get_response_cache().get(message.content)
+        if response is not None:
+            audio_kwargs = await asyncio.to_thread(
+                load_audio_content, response["track"]["preview_uri"]
+            )
+        elif STREAM_ENDPOINT_URL:
+            response, audio_kwargs = await stream_model_api(
+                message.content, loading_msg
+            )
+        else:
+            response = await call_model_api(message.content)
+            audio_kwargs = await asyncio.to_thread(
+                load_audio_content, response["track"]["preview_uri"]
+            )
+        get_response_cache().put(message.content, response)
 
         # Update loading message
         loading_msg.content = "✨ Génération de l'ambiance..."
@@ -282,7 +250,7 @@ async def handle_message(message: Message):
 
         # Prepare elements (lighting + audio)
         elements: list = []
-        lighting_html = create_lighting_animation_html(response.get("lighting", []))
+        lighting_html = get_lighting_renderer().render(response.get("lighting", []))
         if lighting_html:
             elements.append(
                 cl.Text(
@@ -293,16 +261,8 @@ async def handle_message(message: Message):
                 )
             )
 
-        audio_kwargs = load_audio_content(response["track"]["preview_uri"])
         if audio_kwargs:
-            elements.append(
-                cl.Audio(
-                    name="ambiance-audio",
-                    auto_play=True,
-                    display="inline",
-                    **audio_kwargs,
-                )
-            )
+            elements.append(audio_element(audio_kwargs))
 
         # Remove loading message
         await loading_msg.remove()
@@ -0,0 +1,136 @@
+"""Warm-up of the audio previews listed in the mood catalog."""
+
+import csv
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+from src.app.audio_cache import parse_gcs_uri
+from src.app.audio_route import AudioFileStore, get_audio_file_store
+from src.constants import MOOD_CATALOG_URI
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ROUTE = "/warmup"
+WARMUP_MAX_WORKERS = 8
+
+
+class CatalogWarmup:
+    """Prefetch every preview of the mood catalog into the audio caches.
+
+    The catalog CSV is read from ``catalog_uri`` and the ``file_uri`` of each mood is
+    published through the ``AudioFileStore`` by a pool of threads, which resolves its
+    override, downloads it into the ``AudioCache`` and writes it to the disk cache.
+    ``state`` moves from ``idle`` to ``running``, then to ``ready`` when every
+    preview was fetched, ``degraded`` when some failed, or ``failed`` when the
+    catalog could not be read.
+    """
+
+    def __init__(
+        self,
+        catalog_uri: str | None = MOOD_CATALOG_URI,
+        store: AudioFileStore | None = None,
+        max_workers: int = WARMUP_MAX_WORKERS,
+    ) -> None:
+        """Configure the warm-up without starting it."""
+        self.catalog_uri = catalog_uri
+        self.store = store or get_audio_file_store()
+        self.max_workers = max_workers
+        self.state = "idle"
+        self.ready: dict[str, str] = {}
+        self.failed: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        """Run the warm-up in a background thread, once per process."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.state = "running"
+            self._thread = threading.Thread(
+                target=self.run, name="catalog-warmup", daemon=True
+            )
+            self._thread.start()
+
+    def run(self) -> None:
+        """Fetch the catalog previews in parallel and record the outcome."""
+        try:
+            preview_uris = self._read_catalog()
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.error("Could not read mood catalog %s: %s", self.catalog_uri, exc)
+            self.state = "failed"
+            return
+
+        def publish(mood_id: str, uri: str) -> None:
+            try:
+                self.ready[mood_id] = self.store.publish(uri)
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.warning("Could not prefetch %s (%s): %s", mood_id, uri, exc)
+                self.failed[mood_id] = str(exc)
+
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            for mood_id, uri in preview_uris.items():
+                executor.submit(publish, mood_id, uri)
+        self.state = "degraded" if self.failed else "ready"
+        logger.info(
+            "Catalog warm-up %s: %d previews ready, %d failed",
+            self.state,
+            len(self.ready),
+            len(self.failed),
+        )
+
+    def status(self) -> dict[str, Any]:
+        """Readiness of the warm-up and of the audio cache."""
+        return {
+            "state": self.state,
+            "ready": sorted(self.ready),
+            "failed": dict(self.failed),
+            "cache": self.store.cache.stats(),
+        }
+
+    def _read_catalog(self) -> dict[str, str]:
+        """Return the preview URI of each mood of the catalog."""
+        if not self.catalog_uri:
+            raise ValueError("MOOD_CATALOG_URI is not configured")
+        bucket_name, blob_name = parse_gcs_uri(self.catalog_uri)
+        content = (
+            self.store.cache.client.bucket(bucket_name)
+            .blob(blob_name)
+            .download_as_text(encoding="utf-8")
+        )
+        return {
+            row["mood_id"]: row["file_uri"]
+            for row in csv.DictReader(io.StringIO(content))
+            if row.get("file_uri", "").startswith("gs://")
+        }
+
+
+def mount_warmup_route(app: FastAPI, warmup: CatalogWarmup) -> None:
+    """Expose the warm-up status ahead of the catch-all route of the frontend."""
+
+    @app.get(WARMUP_ROUTE)
+    def warmup_status() -> JSONResponse:
+        status = warmup.status()
+        serving = status["state"] in ("ready", "degraded")
+        return JSONResponse(status, status_code=200 if serving else 503)
+
+    app.router.routes.insert(0, app.router.routes.pop())
+
+
+_catalog_warmup: CatalogWarmup | None = None
+_catalog_warmup_lock = threading.Lock()
+
+
+def get_catalog_warmup() -> CatalogWarmup:
+    """Return the catalog warm-up shared by every session of the process."""
+    global _catalog_warmup
+    with _catalog_warmup_lock:
+        if _catalog_warmup is None:
+            _catalog_warmup = CatalogWarmup()
+        return _catalog_warmup
@@ -13,6 +13,9 @@ BUCKET_NAME: str | None = os.getenv("GCP_BUCKET_NAME")
 ENDPOINT_ID: str | None = os.getenv("GCP_ENDPOINT_ID")
 PROJECT_NUMBER: str | None = os.getenv("GCP_PROJECT_NUMBER")
 
+# Local streaming server (scripts/serve_handler.py), e.g. http://127.0.0.1:8080/stream
+STREAM_ENDPOINT_URL: str | None = os.getenv("STREAM_ENDPOINT_URL")
+
 # Paths
 PIPELINE_ROOT_PATH: str = f"{BUCKET_NAME}/vertexai-pipeline-root/"
 
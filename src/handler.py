@@ -1,44 +1,1814 @@
 """Handler for Hugging Face model inference requests."""
 
+import csv
+import json
+import logging
+import math
+import os
+import queue
+import string
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future
+from dataclasses import dataclass, field
 from typing import Any
 
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import (
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    DynamicCache,
+    LogitsProcessor,
+    LogitsProcessorList,
+    TextIteratorStreamer,
+)
 
 MODEL_DIR = "/opt/huggingface/model"
+MAX_BATCH_SIZE = int(os.getenv("HANDLER_MAX_BATCH_SIZE", "16"))
+MAX_BATCH_TOKENS = int(os.getenv("HANDLER_MAX_BATCH_TOKENS", "16384"))
+SCHEDULER = os.getenv("HANDLER_SCHEDULER", "dynamic")
+MAX_WAIT_MS = float(os.getenv("HANDLER_MAX_WAIT_MS", "5"))
+PREFIX_CACHE = os.getenv("HANDLER_PREFIX_CACHE", "true").lower() == "true"
+SYSTEM_PROMPT: str | None = os.getenv("HANDLER_SYSTEM_PROMPT")
+DEVICE = os.getenv("HANDLER_DEVICE", "auto")
+DTYPE = os.getenv("HANDLER_DTYPE", "auto")
+QUANTIZATION = os.getenv("HANDLER_QUANTIZATION", "none")
+# Intra-op threads of CPU backends, 0 keeps the PyTorch default of one per core.
+NUM_THREADS = int(os.getenv("HANDLER_NUM_THREADS", "0"))
+# Speculative decoding drafter: "none", "ngram" or "draft" (HANDLER_DRAFT_MODEL).
+SPECULATIVE = os.getenv("HANDLER_SPECULATIVE", "none")
+DRAFT_MODEL: str | None = os.getenv("HANDLER_DRAFT_MODEL")
+NUM_DRAFT_TOKENS = int(os.getenv("HANDLER_NUM_DRAFT_TOKENS", "8"))
+DRAFT_NGRAM_SIZE = 3
+# Generation parameters that leave greedy decoding unchanged.
+_GREEDY_PARAMETERS = frozenset(
+    {"max_new_tokens", "do_sample", "temperature", "top_k", "top_p", "num_beams"}
+)
+DEFAULT_MAX_NEW_TOKENS = 256
+END_TOKEN = "<|end|>"
+PROMPT_PLACEHOLDER = "<<user-message>>"
+DEFAULT_LIGHTING_TOKENS = 160
+CATALOG_FILENAME = "mood_catalog.csv"
+BASE_MODEL_NAME = "microsoft/Phi-3-mini-4k-instruct"
+# Written by model_export_component next to the fused safetensors shards.
+EXPORT_MANIFEST_FILENAME = "export_manifest.json"
+PAYLOAD_HEAD = '{"track": {"mood_id": "'
+MAX_JSON_STRING_LENGTH = 256
+MAX_LIGHTING_CUES = 8
+
+# Keep in sync with data_transformation_component, which builds the training targets.
+MOOD_NARRATIONS = {
+    "bonnehumeur": "Ambiance solaire et detendue pour entretenir cette bonne humeur.",
+    "curiosite": "Mouvement malicieux et lumineux pour soutenir ta curiosite.",
+    "detente": "Ondes bleutees et calmes pour prolonger ta detente.",
+    "euphorie": "Flux explosif et lumineux qui accompagne ton euphorie.",
+    "reverie": "Atmosphere suspendue propice a la reverie cosmique.",
+    "victoire": "Eclat victorieux pour celebrer cette reussite.",
+    "colere": "Cadence intense pour canaliser et relacher la colere.",
+    "inquietude": "Pulsations feutrees pour apprivoiser cette inquietude.",
+    "nostalgie": "Teintes sepie et rythme doux pour ta nostalgie.",
+    "panique": "Impacts rapides pour te guider dans la panique.",
+    "suspense": "Texture feutree pour soutenir le suspense qui monte.",
+    "tristesse": "Halo discret et consolant pour accueillir la tristesse.",
+}
+MOOD_METRICS = {
+    "bonnehumeur": {"valence": 0.9, "arousal": 0.4},
+    "curiosite": {"valence": 0.6, "arousal": 0.6},
+    "detente": {"valence": 0.7, "arousal": 0.3},
+    "euphorie": {"valence": 0.95, "arousal": 0.85},
+    "reverie": {"valence": 0.5, "arousal": 0.45},
+    "victoire": {"valence": 0.85, "arousal": 0.75},
+    "colere": {"valence": 0.2, "arousal": 0.8},
+    "inquietude": {"valence": 0.35, "arousal": 0.55},
+    "nostalgie": {"valence": 0.5, "arousal": 0.35},
+    "panique": {"valence": 0.1, "arousal": 0.95},
+    "suspense": {"valence": 0.4, "arousal": 0.6},
+    "tristesse": {"valence": 0.15, "arousal": 0.3},
+}
+MOOD_IDS = tuple(MOOD_NARRATIONS)
+
+# Regular patterns are nested tuples: ("literal", text), ("chars", charset),
+# ("sequence", parts), ("choice", alternatives) and ("repeat", part, minimum,
+# maximum), where a ``None`` maximum repeats without bound.
+Pattern = tuple[Any, ...]
+_PRINTABLE_ASCII = frozenset(chr(code) for code in range(0x20, 0x7F))
+_DIGITS = frozenset(string.digits)
+_JSON_STRING_CHARS = _PRINTABLE_ASCII - {'"', "\\"}
+
+logger = logging.getLogger(__name__)
+
+
+def plan_micro_batches(
+    lengths: list[int],
+    max_batch_size: int,
+    max_batch_tokens: int,
+    max_new_tokens: int = 0,
+) -> list[list[int]]:
+    """Group prompt indices of similar token length into micro-batches.
+
+    Prompts are sorted by length so that left-padding stays small. A micro-batch is
+    closed as soon as adding the next prompt would exceed ``max_batch_size`` rows or
+    ``max_batch_tokens`` padded tokens (longest prompt plus ``max_new_tokens``, times
+    the number of rows). A single prompt always gets a batch of its own.
+    """
+    batches: list[list[int]] = []
+    current: list[int] = []
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        padded_tokens = (lengths[index] + max_new_tokens) * (len(current) + 1)
+        if current and (
+            len(current) >= max_batch_size or padded_tokens > max_batch_tokens
+        ):
+            batches.append(current)
+            current = []
+        current.append(index)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _literal(text: str) -> Pattern:
+    """Pattern matching ``text`` exactly."""
+    return ("literal", text)
+
+
+def _chars(characters: frozenset[str] | str) -> Pattern:
+    """Pattern matching a single character of ``characters``."""
+    return ("chars", frozenset(characters))
+
+
+def _sequence(*parts: Pattern) -> Pattern:
+    """Pattern matching ``parts`` one after the other."""
+    return ("sequence", parts)
+
+
+def _choice(*alternatives: Pattern) -> Pattern:
+    """Pattern matching any of ``alternatives``."""
+    return ("choice", alternatives)
+
+
+def _repeat(part: Pattern, minimum: int = 0, maximum: int | None = None) -> Pattern:
+    """Pattern matching ``part`` at least ``minimum`` and at most ``maximum`` times."""
+    return ("repeat", part, minimum, maximum)
+
+
+def _decimal(integer_digits: int, fraction_digits: int) -> Pattern:
+    """Pattern of a non-negative JSON number with bounded integer and fraction parts."""
+    return _sequence(
+        _choice(
+            _literal("0"),
+            _sequence(
+                _chars("123456789"), _repeat(_chars(_DIGITS), 0, integer_digits - 1)
+            ),
+        ),
+        _choice(
+            _literal(""),
+            _sequence(_literal("."), _repeat(_chars(_DIGITS), 1, fraction_digits)),
+        ),
+    )
+
+
+# Every string, number and repetition of the payload is bounded, so that a payload
+# can always be closed and stays far below the default generation budget.
+_JSON_STRING = _repeat(
+    _choice(
+        _chars(_JSON_STRING_CHARS),
+        _sequence(_literal("\\"), _chars('"\\/bfnrt')),
+        _sequence(_literal("\\u"), *[_chars(string.hexdigits)] * 4),
+    ),
+    0,
+    MAX_JSON_STRING_LENGTH,
+)
+# Integers from 0 to 255, without leading zeros.
+_JSON_BYTE = _choice(
+    _chars(_DIGITS),
+    _sequence(_chars("123456789"), _chars(_DIGITS)),
+    _sequence(_literal("1"), _chars(_DIGITS), _chars(_DIGITS)),
+    _sequence(_literal("2"), _chars("01234"), _chars(_DIGITS)),
+    _sequence(_literal("25"), _chars("012345")),
+)
+_JSON_DURATION = _decimal(3, 3)
+# Numbers from 0 to 1, with at most three decimals.
+_JSON_UNIT_NUMBER = _choice(
+    _sequence(
+        _literal("0"),
+        _choice(_literal(""), _sequence(_literal("."), _repeat(_chars(_DIGITS), 1, 3))),
+    ),
+    _sequence(
+        _literal("1"),
+        _choice(_literal(""), _sequence(_literal("."), _repeat(_literal("0"), 1, 3))),
+    ),
+)
+_LIGHTING_CUE = _sequence(
+    _literal('{"rgb": ['),
+    _JSON_BYTE,
+    _literal(", "),
+    _JSON_BYTE,
+    _literal(", "),
+    _JSON_BYTE,
+    _literal('], "duration": '),
+    _JSON_DURATION,
+    _literal(', "intensity": '),
+    _JSON_UNIT_NUMBER,
+    _literal("}"),
+)
+_LIGHTING_CUES = _sequence(
+    _LIGHTING_CUE,
+    _repeat(_sequence(_literal(", "), _LIGHTING_CUE), 0, MAX_LIGHTING_CUES - 1),
+)
+
+
+def lighting_pattern() -> Pattern:
+    """Pattern of the lighting cues following ``"lighting": [`` in the payload."""
+    return _sequence(_LIGHTING_CUES, _literal("]"))
+
+
+def assistant_payload_pattern(mood_ids: tuple[str, ...] = MOOD_IDS) -> Pattern:
+    """Pattern of the Synesthetic DJ JSON payload, as serialized by ``json.dumps``."""
+    return _sequence(
+        _literal('{"track": {"mood_id": "'),
+        _choice(*[_literal(mood_id) for mood_id in mood_ids]),
+        _literal('", "preview_uri": "'),
+        _JSON_STRING,
+        _literal('"}, "lighting": ['),
+        _LIGHTING_CUES,
+        _literal('], "narration": "'),
+        _JSON_STRING,
+        _literal('", "diagnostics": {"valence_hint": '),
+        _JSON_UNIT_NUMBER,
+        _literal(', "arousal_hint": '),
+        _JSON_UNIT_NUMBER,
+        _literal("}}"),
+    )
+
+
+class _Nfa:
+    """Character-level nondeterministic automaton compiled from a pattern."""
+
+    def __init__(self, pattern: Pattern) -> None:
+        """Compile ``pattern`` into character and epsilon transitions."""
+        self.edges: list[list[tuple[frozenset[str], int]]] = []
+        self.epsilons: list[list[int]] = []
+        start, self.final = self._compile(pattern)
+        self.start = self.closure({start})
+        self.distances = self._distances_to_final()
+
+    def _new_state(self) -> int:
+        """Allocate a state without transitions."""
+        self.edges.append([])
+        self.epsilons.append([])
+        return len(self.edges) - 1
+
+    def _compile(self, pattern: Pattern) -> tuple[int, int]:
+        """Compile a pattern into a fragment and return its start and end states."""
+        kind = pattern[0]
+        start = end = self._new_state()
+        if kind == "literal":
+            for character in pattern[1]:
+                target = self._new_state()
+                self.edges[end].append((frozenset(character), target))
+                end = target
+        elif kind == "chars":
+            end = self._new_state()
+            self.edges[start].append((pattern[1], end))
+        elif kind == "sequence":
+            for part in pattern[1]:
+                part_start, part_end = self._compile(part)
+                self.epsilons[end].append(part_start)
+                end = part_end
+        elif kind == "choice":
+            end = self._new_state()
+            for alternative in pattern[1]:
+                part_start, part_end = self._compile(alternative)
+                self.epsilons[start].append(part_start)
+                self.epsilons[part_end].append(end)
+        elif kind == "repeat":
+            _, part, minimum, maximum = pattern
+            for _ in range(minimum):
+                part_start, part_end = self._compile(part)
+                self.epsilons[end].append(part_start)
+                end = part_end
+            loop_end = self._new_state()
+            if maximum is None:
+                part_start, part_end = self._compile(part)
+                self.epsilons[end].extend([part_start, loop_end])
+                self.epsilons[part_end].extend([part_start, loop_end])
+            else:
+                # Bounded repeats chain optional copies, each of which may exit.
+                for _ in range(maximum - minimum):
+                    part_start, part_end = self._compile(part)
+                    self.epsilons[end].extend([part_start, loop_end])
+                    end = part_end
+                self.epsilons[end].append(loop_end)
+            end = loop_end
+        else:
+            raise ValueError(f"Unknown pattern kind: {kind}")
+        return start, end
+
+    def _distances_to_final(self) -> list[float]:
+        """Fewest characters leading from each state to the final state."""
+        predecessors: list[list[tuple[int, int]]] = [[] for _ in self.edges]
+        for state, (edges, epsilons) in enumerate(
+            zip(self.edges, self.epsilons, strict=True)
+        ):
+            for _, target in edges:
+                predecessors[target].append((state, 1))
+            for target in epsilons:
+                predecessors[target].append((state, 0))
+        distances = [math.inf] * len(self.edges)
+        distances[self.final] = 0
+        pending = deque([self.final])
+        while pending:
+            state = pending.popleft()
+            for source, cost in predecessors[state]:
+                if distances[state] + cost < distances[source]:
+                    distances[source] = distances[state] + cost
+                    if cost:
+                        pending.append(source)
+                    else:
+                        pending.appendleft(source)
+        return distances
+
+    def closure(self, states: set[int]) -> frozenset[int]:
+        """Add every state reachable through epsilon transitions."""
+        stack, reached = list(states), set(states)
+        while stack:
+            for target in self.epsilons[stack.pop()]:
+                if target not in reached:
+                    reached.add(target)
+                    stack.append(target)
+        return frozenset(reached)
+
+    def step(self, states: frozenset[int], character: str) -> frozenset[int]:
+        """States reached after reading ``character``; empty when it is rejected."""
+        return self.closure(
+            {
+                target
+                for state in states
+                for characters, target in self.edges[state]
+                if character in characters
+            }
+        )
+
+
+class _TrieNode:
+    """Node of the character trie built over the tokenizer vocabulary."""
+
+    __slots__ = ("children", "token_ids")
+
+    def __init__(self) -> None:
+        """Create an empty node."""
+        self.children: dict[str, _TrieNode] = {}
+        self.token_ids: list[int] = []
+
+
+class TokenGrammar:
+    """Token-level view of a pattern, listing which tokens may come next.
+
+    Only tokens decoding to printable ASCII take part, which is enough for payloads
+    written with ``json.dumps(..., ensure_ascii=True)``. Grammar states are frozen
+    sets of automaton states, so the allowed tokens of a state are computed once by
+    walking a trie of the vocabulary and then cached.
+
+    Each allowed token is cached with the number of tokens still needed to close the
+    pattern after it, counting one token per missing character as every printable
+    ASCII character is a token of its own in the Phi-3 vocabulary. Given the budget
+    of a row, tokens that could not be followed by a closed pattern are dropped, so
+    that a lighting array is closed rather than truncated mid-cue.
+    """
+
+    def __init__(
+        self, tokenizer: AutoTokenizer, pattern: Pattern, close_token_id: int
+    ) -> None:
+        """Index the vocabulary of ``tokenizer`` for ``pattern``."""
+        self._nfa = _Nfa(pattern)
+        self.initial = self._nfa.start
+        self.close_token_id = close_token_id
+        anchor = tokenizer("a", add_special_tokens=False)["input_ids"][-1]
+        anchor_text = tokenizer.decode([anchor])
+        # Added tokens such as <|end|> decode to printable text but are never content.
+        excluded_ids = {
+            close_token_id,
+            *tokenizer.all_special_ids,
+            *tokenizer.added_tokens_decoder,
+        }
+        token_ids = [i for i in range(len(tokenizer)) if i not in excluded_ids]
+        self._token_texts: dict[int, str] = {}
+        self._trie = _TrieNode()
+        for token_id, text in zip(
+            token_ids,
+            tokenizer.batch_decode([[anchor, token_id] for token_id in token_ids]),
+            strict=True,
+        ):
+            text = text[len(anchor_text) :]
+            if not text or not _PRINTABLE_ASCII.issuperset(text):
+                continue
+            self._token_texts[token_id] = text
+            node = self._trie
+            for character in text:
+                node = node.children.setdefault(character, _TrieNode())
+            node.token_ids.append(token_id)
+        self._steps: dict[tuple[frozenset[int], str], frozenset[int]] = {}
+        self._next_token_ids: dict[
+            frozenset[int], tuple[torch.Tensor, torch.Tensor]
+        ] = {}
+
+    def _step(self, state: frozenset[int], character: str) -> frozenset[int]:
+        """Memoized single character transition."""
+        key = (state, character)
+        if key not in self._steps:
+            self._steps[key] = self._nfa.step(state, character)
+        return self._steps[key]
+
+    def advance(self, state: frozenset[int], token_id: int) -> frozenset[int]:
+        """State reached after ``token_id``; empty when the token is rejected."""
+        text = self._token_texts.get(token_id)
+        if text is None:
+            return frozenset()
+        for character in text:
+            state = self._step(state, character)
+            if not state:
+                break
+        return state
+
+    def is_complete(self, state: frozenset[int]) -> bool:
+        """Whether the text read so far matches the whole pattern."""
+        return self._nfa.final in state
+
+    def is_closed(self, state: frozenset[int]) -> bool:
+        """Whether the pattern is complete and nothing else may follow."""
+        return self.is_complete(state) and not any(
+            self._nfa.edges[nfa_state] for nfa_state in state
+        )
+
+    def closing_tokens(self, state: frozenset[int]) -> int:
+        """Fewest tokens completing the pattern after ``state``, closing included."""
+        return int(min(self._nfa.distances[nfa_state] for nfa_state in state)) + 1
+
+    def next_token_ids(
+        self, state: frozenset[int], budget: int | None = None
+    ) -> torch.Tensor:
+        """Ids of the tokens allowed after ``state``, closing token included.
+
+        With a ``budget`` of tokens left, only tokens after which the pattern can
+        still be closed in time are kept, or the quickest ones when none can.
+        """
+        if state not in self._next_token_ids:
+            allowed: list[int] = []
+            costs: list[int] = []
+            if not self.is_closed(state):
+                stack = [(self._trie, state)]
+                while stack:
+                    node, node_state = stack.pop()
+                    for character, child in node.children.items():
+                        child_state = self._step(node_state, character)
+                        if child_state:
+                            allowed.extend(child.token_ids)
+                            costs.extend(
+                                [self.closing_tokens(child_state)]
+                                * len(child.token_ids)
+                            )
+                            stack.append((child, child_state))
+            if self.is_complete(state) or not allowed:
+                allowed.append(self.close_token_id)
+                costs.append(0)
+            self._next_token_ids[state] = (torch.tensor(allowed), torch.tensor(costs))
+        allowed_ids, costs = self._next_token_ids[state]
+        if budget is None:
+            return allowed_ids
+        return allowed_ids[costs <= max(budget - 1, int(costs.min()))]
+
+
+class JsonSchemaLogitsProcessor(LogitsProcessor):
+    """Mask logits so that each generated row follows a ``TokenGrammar``.
+
+    Rows are forced to emit the grammar's closing token as soon as the pattern can
+    not be extended, after which only padding or the closing token are allowed. With
+    ``max_new_tokens``, rows are steered to close the pattern within that budget.
+
+    States are keyed by the tokens generated in a row rather than by its index, as
+    beam search reorders rows between steps: each row extends the state of the row
+    it was generated from at the previous step.
+    """
+
+    def __init__(
+        self,
+        grammar: TokenGrammar,
+        prompt_width: int,
+        pad_token_id: int,
+        max_new_tokens: int | None = None,
+    ) -> None:
+        """Track grammar states for rows whose prompt spans ``prompt_width``."""
+        self.grammar = grammar
+        self.prompt_width = prompt_width
+        self.pad_token_id = pad_token_id
+        self.max_new_tokens = max_new_tokens
+        self.states: dict[tuple[int, ...], frozenset[int] | None] = {}
+
+    def _advance(
+        self, state: frozenset[int] | None, token_id: int
+    ) -> frozenset[int] | None:
+        """State after ``token_id``, ``None`` once the closing token was emitted."""
+        if state is None or token_id == self.grammar.close_token_id:
+            return None
+        return self.grammar.advance(state, token_id)
+
+    def _state(self, generated: tuple[int, ...]) -> frozenset[int] | None:
+        """State of a row, from the previous step or replayed from its tokens."""
+        if generated and generated[:-1] in self.states:
+            return self._advance(self.states[generated[:-1]], generated[-1])
+        state: frozenset[int] | None = self.grammar.initial
+        for token_id in generated:
+            state = self._advance(state, token_id)
+        return state
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor
+    ) -> torch.FloatTensor:
+        """Advance the row states with the last token and mask disallowed ones."""
+        rows = [tuple(row) for row in input_ids[:, self.prompt_width :].tolist()]
+        states = {generated: self._state(generated) for generated in rows}
+        self.states = states
+
+        budget = (
+            None
+            if self.max_new_tokens is None
+            else self.max_new_tokens - (input_ids.shape[1] - self.prompt_width)
+        )
+        mask = torch.full_like(scores, float("-inf"))
+        for row, generated in enumerate(rows):
+            state = states[generated]
+            allowed = (
+                torch.tensor([self.pad_token_id, self.grammar.close_token_id])
+                if state is None
+                else self.grammar.next_token_ids(state, budget)
+            )
+            mask[row, allowed.to(scores.device)] = 0
+        masked_scores = scores + mask
+        # Sampling warpers may already have discarded every allowed token of a row.
+        rejected = torch.isinf(masked_scores).all(dim=-1, keepdim=True)
+        return torch.where(rejected, mask, masked_scores)
+
+
+@dataclass(frozen=True)
+class MoodCatalogEntry:
+    """Catalog fields of the payload that only depend on the ``mood_id``."""
+
+    preview_uri: str
+    narration: str
+    valence_hint: float
+    arousal_hint: float
+
+
+def load_mood_catalog(path: str) -> dict[str, MoodCatalogEntry]:
+    """Load the mood catalog shipped next to the model.
+
+    ``path`` is the ``mood_catalog.csv`` used by the data transformation component,
+    from which only ``mood_id`` and ``file_uri`` are read. When it is missing, the
+    built-in mood ids are used with empty preview URIs.
+    """
+    preview_uris: dict[str, str] = {}
+    if os.path.exists(path):
+        with open(path, newline="", encoding="utf-8") as file:
+            preview_uris = {
+                row["mood_id"]: row["file_uri"] for row in csv.DictReader(file)
+            }
+    else:
+        logger.warning("No mood catalog found at %s", path)
+
+    catalog = {}
+    for mood_id in preview_uris or MOOD_IDS:
+        metrics = MOOD_METRICS.get(mood_id, {"valence": 0.5, "arousal": 0.5})
+        catalog[mood_id] = MoodCatalogEntry(
+            preview_uri=preview_uris.get(mood_id, ""),
+            narration=MOOD_NARRATIONS.get(
+                mood_id, "Ambiance personnalisee pour ton humeur."
+            ),
+            valence_hint=metrics["valence"],
+            arousal_hint=metrics["arousal"],
+        )
+    return catalog
+
+
+@dataclass(frozen=True)
+class ServingBackend:
+    """Device, weight dtype and quantization the model is served with."""
+
+    device: str
+    torch_dtype: torch.dtype
+    quantization: str = "none"
+    num_threads: int = 0
+
+    @property
+    def name(self) -> str:
+        """Short description such as ``cuda:0-float16`` or ``cpu-float32-int8``."""
+        name = f"{self.device}-{str(self.torch_dtype).removeprefix('torch.')}"
+        return name if self.quantization == "none" else f"{name}-{self.quantization}"
+
+
+def resolve_serving_backend(
+    device: str = DEVICE,
+    dtype: str = DTYPE,
+    quantization: str = QUANTIZATION,
+    num_threads: int = NUM_THREADS,
+    default_dtype: str = "float16",
+) -> ServingBackend:
+    """Pick the serving backend from the handler configuration.
+
+    ``device`` is ``"cuda"``, ``"cpu"`` or ``"auto"`` (the GPU when there is one).
+    ``dtype`` ``"auto"`` serves GPUs in ``default_dtype``, the dtype of the exported
+    weights, and CPUs in float32, since most CPU kernels have no fast float16 path;
+    ``"bfloat16"`` suits CPUs with AVX512-BF16 or AMX. ``quantization`` ``"int8"``
+    replaces the linear layers by dynamically quantized ones, which only run on CPU
+    and quantize float32 weights.
+
+    Raises:
+        ValueError: If a value is unknown or the combination cannot run here.
+    """
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    if device == "cuda":
+        if not torch.cuda.is_available():
+            raise ValueError("HANDLER_DEVICE is cuda but no GPU is available")
+        device = "cuda:0"
+    elif device != "cpu":
+        raise ValueError(f"Unknown device: {device}")
+
+    if quantization not in ("none", "int8"):
+        raise ValueError(f"Unknown quantization: {quantization}")
+    if quantization == "int8":
+        if device != "cpu":
+            raise ValueError("int8 dynamic quantization only runs on CPU")
+        if dtype not in ("auto", "float32"):
+            raise ValueError("int8 dynamic quantization requires float32 weights")
+        dtype = "float32"
+    elif dtype == "auto":
+        dtype = default_dtype if device != "cpu" else "float32"
+    if dtype not in ("float16", "bfloat16", "float32"):
+        raise ValueError(f"Unknown dtype: {dtype}")
+    return ServingBackend(device, getattr(torch, dtype), quantization, num_threads)
+
+
+def load_export_manifest(model_dir: str) -> dict[str, Any] | None:
+    """Read the manifest of a model fused by the export component, if any.
+
+    Models without a manifest are LoRA adapters saved by the fine-tuning component,
+    which ``from_pretrained`` applies on top of the base model at load time.
+    """
+    path = os.path.join(model_dir, EXPORT_MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+@dataclass
+class _PendingRequest:
+    """Single prompt waiting in a scheduler queue."""
+
+    prompt: str
+    parameters: dict[str, Any]
+    future: Future[str] = field(default_factory=Future)
+
+
+class DynamicBatchScheduler:
+    """Micro-batching scheduler collecting concurrent requests into one generation.
+
+    Callers submit prompts from any thread and block on the returned future. A
+    background worker waits at most ``max_wait_ms`` after the first queued prompt for
+    more to arrive, up to ``max_batch_size``, then runs the whole window through
+    ``EndpointHandler.generate_batch`` and fans the predictions back out. Prompts are
+    only batched together when their generation parameters are identical.
+    """
+
+    def __init__(
+        self,
+        handler: "EndpointHandler",
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait_ms: float = MAX_WAIT_MS,
+    ) -> None:
+        """Start the background worker for the given handler.
+
+        The prefix cache and system prompt are those of ``handler``, which the
+        scheduler calls through ``generate_batch``.
+        """
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000
+        self._queue: queue.Queue[_PendingRequest | None] = queue.Queue()
+        self._worker = threading.Thread(
+            target=self._run, name="dynamic-batch-scheduler", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, prompt: str, parameters: dict[str, Any]) -> Future[str]:
+        """Queue a prompt and return the future of its prediction."""
+        request = _PendingRequest(prompt, parameters)
+        self._queue.put(request)
+        return request.future
+
+    def close(self) -> None:
+        """Stop the worker once the already queued prompts are processed."""
+        self._queue.put(None)
+        self._worker.join()
+
+    def _run(self) -> None:
+        """Collect request windows and dispatch them until closed."""
+        while (first := self._queue.get()) is not None:
+            window = [first]
+            deadline = time.monotonic() + self.max_wait_s
+            closed = False
+            while len(window) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    request = (
+                        self._queue.get(timeout=timeout)
+                        if timeout > 0
+                        else self._queue.get_nowait()
+                    )
+                except queue.Empty:
+                    break
+                if request is None:
+                    closed = True
+                    break
+                window.append(request)
+            self._dispatch(window)
+            if closed:
+                return
+
+    def _dispatch(self, window: list[_PendingRequest]) -> None:
+        """Generate predictions for a window, one call per parameter set."""
+        groups: dict[str, list[_PendingRequest]] = {}
+        for request in window:
+            key = json.dumps(request.parameters, sort_keys=True, default=str)
+            groups.setdefault(key, []).append(request)
+
+        for requests in groups.values():
+            try:
+                predictions = self.handler.generate_batch(
+                    [request.prompt for request in requests],
+                    **requests[0].parameters,
+                )
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.exception("Batched generation failed")
+                for request in requests:
+                    request.future.set_exception(exc)
+                continue
+            for request, prediction in zip(requests, predictions, strict=True):
+                request.future.set_result(prediction)
+
+
+@dataclass
+class _ActiveSequence:
+    """Sequence admitted in the continuous batching decode loop."""
+
+    request: _PendingRequest
+    prompt_ids: list[int]
+    generated: list[int] = field(default_factory=list)
+    grammar_state: frozenset[int] | None = None
+
+    @property
+    def max_new_tokens(self) -> int:
+        """Maximum number of tokens this request may generate."""
+        return int(
+            self.request.parameters.get("max_new_tokens", DEFAULT_MAX_NEW_TOKENS)
+        )
+
+
+class ContinuousBatchingEngine:
+    """Iteration-level scheduler sharing one decode loop between requests.
+
+    Every prompt is prefilled on its own, then its KV cache is left-padded into the
+    running batch cache so that it joins the next decoding step. Each step feeds one
+    token per active sequence; a sequence leaves the batch as soon as it produces a
+    stop token or reaches its ``max_new_tokens``, freeing its slot for a queued
+    request. Short answers are therefore never held back by long ones.
+
+    Only ``max_new_tokens``, ``do_sample``, ``temperature``, ``top_k``, ``top_p``,
+    ``skip_special_tokens`` and ``constrained_json`` are honoured from the request
+    parameters.
+    """
+
+    def __init__(
+        self, handler: "EndpointHandler", max_batch_size: int = MAX_BATCH_SIZE
+    ) -> None:
+        """Start the decode loop for the given handler."""
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self._queue: queue.Queue[_PendingRequest | None] = queue.Queue()
+        self._sequences: list[_ActiveSequence] = []
+        self._cache: DynamicCache | None = None
+        self._attention_mask: torch.Tensor | None = None
+        self._worker = threading.Thread(
+            target=self._run, name="continuous-batching-engine", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, prompt: str, parameters: dict[str, Any]) -> Future[str]:
+        """Queue a prompt and return the future of its prediction."""
+        request = _PendingRequest(prompt, parameters)
+        self._queue.put(request)
+        return request.future
+
+    def close(self) -> None:
+        """Stop the decode loop once the already queued prompts are processed."""
+        self._queue.put(None)
+        self._worker.join()
+
+    def _run(self) -> None:
+        """Admit queued requests and run decoding steps until closed."""
+        closed = False
+        while not closed or self._sequences:
+            while not closed and len(self._sequences) < self.max_batch_size:
+                try:
+                    request = (
+                        self._queue.get_nowait()
+                        if self._sequences
+                        else self._queue.get()
+                    )
+                except queue.Empty:
+                    break
+                if request is None:
+                    closed = True
+                    break
+                self._admit(request)
+            if not self._sequences:
+                continue
+            try:
+                self._step()
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.exception("Continuous batching step failed")
+                for sequence in self._sequences:
+                    sequence.request.future.set_exception(exc)
+                self._sequences, self._cache, self._attention_mask = [], None, None
+
+    @torch.inference_mode()
+    def _admit(self, request: _PendingRequest) -> None:
+        """Prefill a request and merge its KV cache into the running batch."""
+        try:
+            prompt_ids = self.handler.tokenizer(
+                request.prompt, add_special_tokens=False
+            )["input_ids"]
+            prefix_length, cache = self.handler.prefix_cache_for([prompt_ids])
+            cache = cache or DynamicCache()
+            logits = self.handler.model(
+                input_ids=torch.tensor(
+                    [prompt_ids[prefix_length:]], device=self.handler.model.device
+                ),
+                past_key_values=cache,
+                use_cache=True,
+            ).logits[:, -1, :]
+            sequence = _ActiveSequence(request, prompt_ids)
+            if request.parameters.get("constrained_json", False):
+                sequence.grammar_state = self.handler.json_grammar.initial
+            sequence.generated.append(self._select_token(logits[0], sequence))
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.exception("Prefill failed")
+            request.future.set_exception(exc)
+            return
+        if self._is_finished(sequence):
+            self._resolve(sequence)
+            return
+
+        mask = torch.ones(
+            (1, len(prompt_ids)), dtype=torch.long, device=self.handler.model.device
+        )
+        if self._cache is None or self._attention_mask is None:
+            self._cache, self._attention_mask = cache, mask
+        else:
+            length = max(self._attention_mask.shape[1], mask.shape[1])
+            self._cache = DynamicCache.from_legacy_cache(
+                tuple(
+                    (
+                        torch.cat([_left_pad(key, length), _left_pad(new_key, length)]),
+                        torch.cat(
+                            [_left_pad(value, length), _left_pad(new_value, length)]
+                        ),
+                    )
+                    for (key, value), (new_key, new_value) in zip(
+                        self._cache.to_legacy_cache(),
+                        cache.to_legacy_cache(),
+                        strict=True,
+                    )
+                )
+            )
+            self._attention_mask = torch.cat(
+                [
+                    _left_pad(self._attention_mask, length, dim=1),
+                    _left_pad(mask, length, dim=1),
+                ]
+            )
+        self._sequences.append(sequence)
+
+    @torch.inference_mode()
+    def _step(self) -> None:
+        """Decode one token for every active sequence and retire finished ones."""
+        assert self._cache is not None
+        assert self._attention_mask is not None
+        device = self.handler.model.device
+        self._attention_mask = torch.cat(
+            [
+                self._attention_mask,
+                self._attention_mask.new_ones((len(self._sequences), 1)),
+            ],
+            dim=1,
+        )
+        logits = self.handler.model(
+            input_ids=torch.tensor(
+                [[sequence.generated[-1]] for sequence in self._sequences],
+                device=device,
+            ),
+            attention_mask=self._attention_mask,
+            position_ids=self._attention_mask.sum(dim=1, keepdim=True) - 1,
+            past_key_values=self._cache,
+            use_cache=True,
+        ).logits[:, -1, :]
+
+        keep: list[int] = []
+        for row, sequence in enumerate(self._sequences):
+            sequence.generated.append(self._select_token(logits[row], sequence))
+            if self._is_finished(sequence):
+                self._resolve(sequence)
+            else:
+                keep.append(row)
+        if len(keep) == len(self._sequences):
+            return
+
+        self._sequences = [self._sequences[row] for row in keep]
+        if not keep:
+            self._cache, self._attention_mask = None, None
+            return
+        indices = torch.tensor(keep, device=device)
+        self._cache.batch_select_indices(indices)
+        self._attention_mask = self._attention_mask[indices]
+        # Drop the columns that only held padding for the retired sequences.
+        unused = int(self._attention_mask.any(dim=0).long().argmax())
+        if unused:
+            self._attention_mask = self._attention_mask[:, unused:]
+            self._cache = DynamicCache.from_legacy_cache(
+                tuple(
+                    (key[:, :, unused:], value[:, :, unused:])
+                    for key, value in self._cache.to_legacy_cache()
+                )
+            )
+
+    def _select_token(self, logits: torch.Tensor, sequence: _ActiveSequence) -> int:
+        """Pick the next token of a sequence, masked by its grammar if it has one."""
+        state = sequence.grammar_state
+        if state is None:
+            return self._sample(logits, sequence.request.parameters)
+
+        grammar = self.handler.json_grammar
+        budget = sequence.max_new_tokens - len(sequence.generated)
+        mask = torch.full_like(logits, float("-inf"))
+        mask[grammar.next_token_ids(state, budget).to(logits.device)] = 0
+        token_id = self._sample(logits + mask, sequence.request.parameters)
+        sequence.grammar_state = grammar.advance(state, token_id)
+        return token_id
+
+    @staticmethod
+    def _sample(logits: torch.Tensor, parameters: dict[str, Any]) -> int:
+        """Pick a token from a row of logits, greedily unless ``do_sample`` is set."""
+        if not parameters.get("do_sample", False):
+            return int(logits.argmax())
+
+        logits = logits.float() / float(parameters.get("temperature", 1.0))
+        top_k = int(parameters.get("top_k", 50))
+        if 0 < top_k < logits.shape[-1]:
+            threshold = torch.topk(logits, top_k).values[-1]
+            logits = logits.masked_fill(logits < threshold, float("-inf"))
+        top_p = float(parameters.get("top_p", 1.0))
+        if top_p < 1.0:
+            sorted_logits, sorted_indices = torch.sort(logits, descending=True)
+            cumulative = sorted_logits.softmax(dim=-1).cumsum(dim=-1)
+            removed = cumulative - sorted_logits.softmax(dim=-1) > top_p
+            logits[sorted_indices[removed]] = float("-inf")
+        return int(torch.multinomial(logits.softmax(dim=-1), num_samples=1))
+
+    def _is_finished(self, sequence: _ActiveSequence) -> bool:
+        """Whether a sequence produced a stop token or exhausted its budget."""
+        return (
+            sequence.generated[-1] in self.handler.stop_token_ids
+            or len(sequence.generated) >= sequence.max_new_tokens
+        )
+
+    def _resolve(self, sequence: _ActiveSequence) -> None:
+        """Decode a finished sequence and hand it to its caller."""
+        sequence.request.future.set_result(
+            self.handler.tokenizer.decode(
+                sequence.prompt_ids + sequence.generated,
+                skip_special_tokens=sequence.request.parameters.get(
+                    "skip_special_tokens", False
+                ),
+            )
+        )
+
+
+def _common_prefix_length(first: list[int], second: list[int]) -> int:
+    """Number of leading tokens shared by two token id lists."""
+    length = 0
+    for first_id, second_id in zip(first, second, strict=False):
+        if first_id != second_id:
+            break
+        length += 1
+    return length
+
+
+def _left_pad(tensor: torch.Tensor, length: int, dim: int = 2) -> torch.Tensor:
+    """Left-pad ``tensor`` with zeros along ``dim`` up to ``length``."""
+    missing = length - tensor.shape[dim]
+    if missing == 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = missing
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+
+def payload_seed_texts(catalog: dict[str, MoodCatalogEntry]) -> list[str]:
+    """One assistant payload per catalog mood, as seeds of the n-gram drafter.
+
+    They hold the keys, punctuation, preview URIs, narrations and diagnostics the
+    model writes; the lighting cue is a placeholder whose numbers rarely match.
+    """
+    return [
+        json.dumps(
+            {
+                "track": {"mood_id": mood_id, "preview_uri": entry.preview_uri},
+                "lighting": [{"rgb": [0, 0, 0], "duration": 0, "intensity": 0.0}],
+                "narration": entry.narration,
+                "diagnostics": {
+                    "valence_hint": entry.valence_hint,
+                    "arousal_hint": entry.arousal_hint,
+                },
+            },
+            ensure_ascii=True,
+        )
+        + END_TOKEN
+        for mood_id, entry in catalog.items()
+    ]
+
+
+class NgramDrafter:
+    """Draft tokens by looking up the last n-gram of the sequence.
+
+    The longest suffix of at most ``max_ngram_size`` tokens is searched in the
+    sequence itself, most recent occurrence first, then in the seed sequences, and
+    the tokens that followed it are proposed. It needs no model, keeps no state
+    between calls and suits outputs that repeat their prompt or known strings.
+    """
+
+    def __init__(
+        self, seeds: list[list[int]], max_ngram_size: int = DRAFT_NGRAM_SIZE
+    ) -> None:
+        """Index the first occurrence of every n-gram of the seeds."""
+        self.seeds = seeds
+        self.max_ngram_size = max_ngram_size
+        self._index: dict[tuple[int, ...], tuple[int, int]] = {}
+        for seed_index, seed in enumerate(seeds):
+            for end in range(1, len(seed)):
+                for size in range(1, min(max_ngram_size, end) + 1):
+                    self._index.setdefault(
+                        tuple(seed[end - size : end]), (seed_index, end)
+                    )
+
+    def propose(self, token_ids: list[int], num_tokens: int) -> list[int]:
+        """Up to ``num_tokens`` tokens likely to follow ``token_ids``."""
+        for size in range(min(self.max_ngram_size, len(token_ids) - 1), 0, -1):
+            suffix = token_ids[-size:]
+            for start in range(len(token_ids) - size - 1, -1, -1):
+                if token_ids[start : start + size] == suffix:
+                    return token_ids[start + size : start + size + num_tokens]
+            if (match := self._index.get(tuple(suffix))) is not None:
+                seed_index, end = match
+                return self.seeds[seed_index][end : end + num_tokens]
+        return []
+
+
+class DraftModelDrafter:
+    """Draft tokens by greedy decoding with a small model sharing the tokenizer.
+
+    The drafter keeps the KV cache of the sequence it last drafted for and crops it
+    to the prefix shared with the next call, so only the tokens accepted since then
+    are prefilled. One drafter follows one sequence at a time.
+    """
+
+    def __init__(self, model: AutoModelForCausalLM) -> None:
+        """Wrap a loaded draft model."""
+        self.model = model
+        self._token_ids: list[int] = []
+        self._cache = DynamicCache()
+
+    @torch.inference_mode()
+    def propose(self, token_ids: list[int], num_tokens: int) -> list[int]:
+        """Greedily decode ``num_tokens`` tokens after ``token_ids``."""
+        shared = min(
+            _common_prefix_length(self._token_ids, token_ids), len(token_ids) - 1
+        )
+        if shared == 0:
+            self._cache = DynamicCache()
+        else:
+            self._cache.crop(shared)
+        self._token_ids = token_ids[:shared]
+        feed = token_ids[shared:]
+        drafts: list[int] = []
+        for _ in range(num_tokens):
+            logits = self.model(
+                input_ids=torch.tensor([feed], device=self.model.device),
+                past_key_values=self._cache,
+                use_cache=True,
+            ).logits[0, -1]
+            self._token_ids += feed
+            feed = [int(logits.argmax())]
+            drafts += feed
+        return drafts
+
+
+@dataclass
+class SpeculationStats:
+    """Counters of speculative decoding, summed over requests."""
+
+    sequences: int = 0
+    forward_passes: int = 0
+    draft_tokens: int = 0
+    accepted_tokens: int = 0
+    generated_tokens: int = 0
+
+    def as_dict(self) -> dict[str, float]:
+        """Counters with the acceptance rate and the tokens per forward pass."""
+        return {
+            **self.__dict__,
+            "acceptance_rate": (
+                self.accepted_tokens / self.draft_tokens if self.draft_tokens else 0.0
+            ),
+            "tokens_per_forward_pass": (
+                self.generated_tokens / self.forward_passes
+                if self.forward_passes
+                else 0.0
+            ),
+        }
 
 
 class EndpointHandler:
     """Handler for processing inference requests using a Hugging Face model."""
 
-    def __init__(self, model_dir: str = MODEL_DIR) -> None:
-        """Load tokenizer and model from the specified directory."""
+    def __init__(
+        self,
+        model_dir: str = MODEL_DIR,
+        *,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_batch_tokens: int = MAX_BATCH_TOKENS,
+        scheduler: str = SCHEDULER,
+        max_wait_ms: float = MAX_WAIT_MS,
+        prefix_cache: bool = PREFIX_CACHE,
+        system_prompt: str | None = SYSTEM_PROMPT,
+        backend: ServingBackend | None = None,
+        speculative: str = SPECULATIVE,
+        draft_model: str | None = DRAFT_MODEL,
+        num_draft_tokens: int = NUM_DRAFT_TOKENS,
+    ) -> None:
+        """Load tokenizer and model from the specified directory.
+
+        ``scheduler`` selects how concurrent requests reach the model: ``"dynamic"``
+        merges them in windows of ``max_wait_ms`` through a ``DynamicBatchScheduler``,
+        ``"continuous"`` admits them into a running ``ContinuousBatchingEngine`` decode
+        loop and ``"none"`` runs each request's instances on their own.
+
+        With ``prefix_cache``, the KV cache of the chat template tokens preceding the
+        user message (including ``system_prompt`` when clients send one) is computed
+        once here and reused, so only the user-specific suffix is prefilled per call.
+
+        Requests whose parameters set ``"mode": "catalog"`` skip free generation and
+        go through ``predict_catalog`` instead, and ``"mode": "stats"`` returns the
+        ``stats`` of the handler. Any other mode than these and ``"generate"`` raises
+        ``ValueError``.
+
+        A ``model_dir`` holding an export manifest is loaded as a plain fused model
+        with its own tokenizer; otherwise it is treated as a LoRA adapter of
+        ``BASE_MODEL_NAME``.
+
+        ``backend`` defaults to the one configured by the ``HANDLER_DEVICE``,
+        ``HANDLER_DTYPE``, ``HANDLER_QUANTIZATION`` and ``HANDLER_NUM_THREADS``
+        variables (see ``resolve_serving_backend``). int8 quantization is meant for
+        fused exports, as it also quantizes the LoRA layers of an adapter.
+
+        ``speculative`` enables speculative decoding of greedy requests (see
+        ``_generate_speculative``) with up to ``num_draft_tokens`` tokens drafted per
+        step, either by an ``NgramDrafter`` seeded with the catalog payloads
+        (``"ngram"``) or by the small ``draft_model`` (``"draft"``), which must share
+        the tokenizer of the model.
+        """
+        manifest = load_export_manifest(model_dir)
+        if manifest is not None:
+            logger.info(
+                "Loading %s model fused from %s",
+                manifest["format"],
+                manifest["base_model"],
+            )
         self.tokenizer = AutoTokenizer.from_pretrained(
-            "microsoft/Phi-3-mini-4k-instruct"
+            model_dir if manifest is not None else BASE_MODEL_NAME
         )
+        self.tokenizer.pad_token = self.tokenizer.unk_token
+        self.tokenizer.pad_token_id = self.tokenizer.unk_token_id
+        self.tokenizer.padding_side = "left"
+        self.stop_token_ids = [self.tokenizer.eos_token_id]
+        self.end_token_id = self.tokenizer.eos_token_id
+        end_token_id = self.tokenizer.convert_tokens_to_ids(END_TOKEN)
+        if end_token_id not in (None, self.tokenizer.unk_token_id):
+            # Beam search ends finished hypotheses with the first stop token.
+            self.stop_token_ids.insert(0, end_token_id)
+            self.end_token_id = end_token_id
+        self.backend = backend or resolve_serving_backend(
+            default_dtype=manifest["torch_dtype"] if manifest else "float16"
+        )
+        if self.backend.device == "cpu" and self.backend.num_threads > 0:
+            torch.set_num_threads(self.backend.num_threads)
+        logger.info("Serving on %s", self.backend.name)
         self.model = AutoModelForCausalLM.from_pretrained(
-            model_dir, torch_dtype=torch.float16, device_map="cuda:0"
+            model_dir,
+            torch_dtype=self.backend.torch_dtype,
+            device_map=self.backend.device,
         ).eval()
+        if self.backend.quantization == "int8":
+            self.model = torch.ao.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.catalog = load_mood_catalog(os.path.join(model_dir, CATALOG_FILENAME))
+        self.speculative = speculative
+        self.num_draft_tokens = num_draft_tokens
+        self.speculation_stats = SpeculationStats()
+        self._speculation_lock = threading.Lock()
+        self._ngram_drafter: NgramDrafter | None = None
+        self.draft_model: AutoModelForCausalLM | None = None
+        if speculative == "ngram":
+            self._ngram_drafter = NgramDrafter(
+                self.tokenizer(
+                    payload_seed_texts(self.catalog), add_special_tokens=False
+                )["input_ids"]
+            )
+        elif speculative == "draft":
+            if not draft_model:
+                raise ValueError("Speculative decoding with a draft model needs one")
+            self.draft_model = self._load_draft_model(draft_model)
+        elif speculative != "none":
+            raise ValueError(f"Unknown speculative decoding drafter: {speculative}")
+        self._grammars: dict[str, TokenGrammar] = {}
+        self._grammars_lock = threading.Lock()
+        self._prefix_ids: list[int] = []
+        self._prefix_cache: tuple[tuple[torch.Tensor, torch.Tensor], ...] | None = None
+        if prefix_cache:
+            self._build_prefix_cache(system_prompt)
+        self.scheduler: DynamicBatchScheduler | ContinuousBatchingEngine | None = None
+        if scheduler == "dynamic":
+            self.scheduler = DynamicBatchScheduler(self, max_batch_size, max_wait_ms)
+        elif scheduler == "continuous":
+            self.scheduler = ContinuousBatchingEngine(self, max_batch_size)
+        elif scheduler != "none":
+            raise ValueError(f"Unknown scheduler: {scheduler}")
+
+    @torch.no_grad()
+    def _build_prefix_cache(self, system_prompt: str | None) -> None:
+        """Precompute the KV cache of the chat template prefix."""
+        messages = (
+            [{"role": "system", "content": system_prompt}] if system_prompt else []
+        )
+        template = self.tokenizer.apply_chat_template(
+            [*messages, {"role": "user", "content": PROMPT_PLACEHOLDER}],
+            tokenize=False,
+            add_generation_prompt=True,
+        )
+        self._prefix_ids = self.tokenizer(
+            template.split(PROMPT_PLACEHOLDER)[0], add_special_tokens=False
+        )["input_ids"]
+        if not self._prefix_ids:
+            return
+        cache = self.model(
+            input_ids=torch.tensor([self._prefix_ids], device=self.model.device),
+            past_key_values=DynamicCache(),
+            use_cache=True,
+        ).past_key_values
+        self._prefix_cache = cache.to_legacy_cache()
+        logger.info(
+            "Cached KV states of a %d token prompt prefix", len(self._prefix_ids)
+        )
+
+    def prefix_cache_for(
+        self, input_ids: list[list[int]]
+    ) -> tuple[int, DynamicCache | None]:
+        """Return the cached prefix shared by all rows and its batched KV cache.
+
+        The prefix is cut so that every row keeps at least one token to prefill. When
+        no cached token is shared by every row, ``(0, None)`` is returned.
+        """
+        if self._prefix_cache is None:
+            return 0, None
+        prefix_length = min(
+            _common_prefix_length(self._prefix_ids, ids[:-1]) for ids in input_ids
+        )
+        if prefix_length == 0:
+            return 0, None
+        return prefix_length, DynamicCache.from_legacy_cache(
+            tuple(
+                (
+                    key[:, :, :prefix_length].expand(len(input_ids), -1, -1, -1),
+                    value[:, :, :prefix_length].expand(len(input_ids), -1, -1, -1),
+                )
+                for key, value in self._prefix_cache
+            )
+        )
+
+    def _grammar(self, name: str, pattern: Pattern) -> TokenGrammar:
+        """Return the named grammar, indexing the vocabulary on first use."""
+        with self._grammars_lock:
+            if name not in self._grammars:
+                self._grammars[name] = TokenGrammar(
+                    self.tokenizer, pattern, self.end_token_id
+                )
+            return self._grammars[name]
+
+    @property
+    def json_grammar(self) -> TokenGrammar:
+        """Grammar of the whole assistant payload."""
+        return self._grammar("payload", assistant_payload_pattern(tuple(self.catalog)))
+
+    @property
+    def lighting_grammar(self) -> TokenGrammar:
+        """Grammar of the lighting cues of the assistant payload."""
+        return self._grammar("lighting", lighting_pattern())
 
     def generate(self, prompt, skip_special_tokens=False, **kwargs: Any) -> str:
         """Generate text based on the input prompt."""
-        tokenized_input = self.tokenizer(
-            prompt, add_special_tokens=False, return_tensors="pt"
-        ).to(self.model.device)
+        return self.generate_batch(
+            [prompt], skip_special_tokens=skip_special_tokens, **kwargs
+        )[0]
+
+    def generate_batch(
+        self,
+        prompts: list[str],
+        *,
+        skip_special_tokens: bool = False,
+        constrained_json: bool = False,
+        speculative: bool = True,
+        **kwargs: Any,
+    ) -> list[str]:
+        """Generate text for several prompts, decoding micro-batches together.
+
+        Prompts are grouped by token length, padded into a single tensor per
+        micro-batch and decoded in one ``generate`` call. Padding goes right after the
+        cached template prefix (or on the left when none applies) so that every row
+        shares the prefix KV cache. Outputs are returned in the order of ``prompts``
+        and contain neither the padding nor anything generated after the first stop
+        token (end-of-sequence or ``<|end|>``), so they match the one-prompt-at-a-time
+        path.
+
+        With ``constrained_json``, logits are masked against the assistant payload
+        grammar (``mood_id`` restricted to the catalog ids) and generation ends with
+        ``<|end|>`` as soon as the JSON object is closed.
+
+        Greedy requests go through speculative decoding, one prompt at a time, when
+        the handler has a drafter, unless ``speculative`` is false.
+        """
+        input_ids = self.tokenizer(prompts, add_special_tokens=False)["input_ids"]
+        batches = plan_micro_batches(
+            [len(ids) for ids in input_ids],
+            self.max_batch_size,
+            self.max_batch_tokens,
+            int(kwargs.get("max_new_tokens") or 0),
+        )
+        grammar = self.json_grammar if constrained_json else None
+
+        outputs: list[str] = [""] * len(prompts)
+        for batch in batches:
+            sequences = self._generate_rows(
+                [input_ids[i] for i in batch],
+                grammar,
+                speculative=speculative,
+                **kwargs,
+            )
+            for index, text in zip(
+                batch,
+                self.tokenizer.batch_decode(
+                    sequences, skip_special_tokens=skip_special_tokens
+                ),
+                strict=True,
+            ):
+                outputs[index] = text
+        return outputs
+
+    def stream(
+        self,
+        prompt: str,
+        *,
+        skip_special_tokens: bool = False,
+        constrained_json: bool = False,
+        speculative: bool = True,
+        **kwargs: Any,
+    ) -> Iterator[str]:
+        """Yield the text generated for ``prompt`` as it is decoded.
+
+        Generation runs in a background thread feeding a ``TextIteratorStreamer``; the
+        prompt itself is not yielded. Errors raised by generation are re-raised once
+        the stream is exhausted.
+        """
+        streamer = TextIteratorStreamer(
+            self.tokenizer, skip_prompt=True, skip_special_tokens=skip_special_tokens
+        )
+        grammar = self.json_grammar if constrained_json else None
+        prompt_ids = self.tokenizer(prompt, add_special_tokens=False)["input_ids"]
+        errors: list[Exception] = []
+
+        def run() -> None:
+            try:
+                self._generate_rows(
+                    [prompt_ids],
+                    grammar,
+                    speculative=speculative,
+                    streamer=streamer,
+                    **kwargs,
+                )
+            except Exception as exc:  # pylint: disable=broad-except
+                errors.append(exc)
+                streamer.end()
+
+        thread = threading.Thread(target=run, name="stream-generation", daemon=True)
+        thread.start()
+        yield from streamer
+        thread.join()
+        if errors:
+            raise errors[0]
+
+    def _generate_rows(
+        self,
+        rows: list[list[int]],
+        grammar: TokenGrammar | None,
+        *,
+        speculative: bool = True,
+        **kwargs: Any,
+    ) -> list[list[int]]:
+        """Run one ``generate`` call and return each row's prompt and output ids."""
+        if speculative and self._speculates(kwargs):
+            streamer = kwargs.get("streamer")
+            return [
+                self._generate_speculative(
+                    ids, grammar, int(kwargs["max_new_tokens"]), streamer
+                )
+                for ids in rows
+            ]
+        prefix_length, past_key_values = (
+            self.prefix_cache_for(rows)
+            if int(kwargs.get("num_beams", 1)) == 1
+            else (0, None)
+        )
+        tokenized_input = self._pad_after_prefix(rows, prefix_length)
+        width = tokenized_input["input_ids"].shape[1]
+        if grammar is not None:
+            kwargs["logits_processor"] = LogitsProcessorList(
+                [
+                    JsonSchemaLogitsProcessor(
+                        grammar,
+                        width,
+                        self.tokenizer.pad_token_id,
+                        kwargs.get("max_new_tokens"),
+                    )
+                ]
+            )
         generation_output = self.model.generate(
             **tokenized_input,
-            eos_token_id=self.tokenizer.eos_token_id,
+            past_key_values=past_key_values,
+            eos_token_id=self.stop_token_ids,
+            pad_token_id=self.tokenizer.pad_token_id,
             **kwargs,
         )
-        return self.tokenizer.batch_decode(
-            generation_output, skip_special_tokens=skip_special_tokens
+        attention_mask = tokenized_input["attention_mask"].tolist()
+        return [
+            self._trim_sequence(
+                [
+                    token_id
+                    for token_id, attended in zip(
+                        output[:width], attention_mask[row], strict=True
+                    )
+                    if attended
+                ]
+                + output[width:],
+                len(rows[row]),
+            )
+            for row, output in enumerate(generation_output.tolist())
+        ]
+
+    def _load_draft_model(self, name_or_path: str) -> AutoModelForCausalLM:
+        """Load the draft model on the serving backend of the model."""
+        if AutoTokenizer.from_pretrained(name_or_path).get_vocab() != (
+            self.tokenizer.get_vocab()
+        ):
+            raise ValueError(f"Draft model {name_or_path} has another tokenizer")
+        draft_model = AutoModelForCausalLM.from_pretrained(
+            name_or_path,
+            torch_dtype=self.backend.torch_dtype,
+            device_map=self.backend.device,
+        ).eval()
+        if self.backend.quantization == "int8":
+            draft_model = torch.ao.quantization.quantize_dynamic(
+                draft_model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        logger.info("Drafting with %s", name_or_path)
+        return draft_model
+
+    def _speculates(self, kwargs: dict[str, Any]) -> bool:
+        """Whether a ``generate`` call may be replaced by speculative decoding.
+
+        Only greedy calls with an explicit ``max_new_tokens`` qualify; sampling
+        parameters are ignored by greedy ``generate`` and so are allowed.
+        """
+        return (
+            self.speculative != "none"
+            and "max_new_tokens" in kwargs
+            and not kwargs.get("do_sample", False)
+            and int(kwargs.get("num_beams", 1)) == 1
+            and set(kwargs) <= _GREEDY_PARAMETERS | {"streamer"}
+        )
+
+    def _greedy_token(
+        self,
+        logits: torch.Tensor,
+        grammar: TokenGrammar | None,
+        state: frozenset[int] | None,
+        budget: int,
+    ) -> tuple[int, frozenset[int] | None]:
+        """Greedy choice among the tokens the grammar allows, and the next state."""
+        if grammar is None or state is None:
+            return int(logits.argmax()), state
+        mask = torch.full_like(logits, float("-inf"))
+        mask[grammar.next_token_ids(state, budget).to(logits.device)] = 0
+        token_id = int((logits + mask).argmax())
+        return token_id, grammar.advance(state, token_id)
+
+    @torch.inference_mode()
+    def _generate_speculative(
+        self,
+        prompt_ids: list[int],
+        grammar: TokenGrammar | None,
+        max_new_tokens: int,
+        streamer: TextIteratorStreamer | None = None,
+    ) -> list[int]:
+        """Greedily decode one prompt, checking drafted tokens in a single pass.
+
+        At each step the drafter proposes tokens following the sequence. The model
+        reads the last accepted token and the drafts in one forward pass, keeps the
+        drafts matching its own greedy choices (masked by ``grammar`` if given) and
+        adds its choice at the first mismatch, or after the last draft. The KV cache
+        is cropped back to the accepted tokens, so the output is the one of greedy
+        ``generate`` up to floating point differences between one-token and
+        several-token forward passes, with one or more tokens per pass.
+        """
+        drafter = (
+            DraftModelDrafter(self.draft_model)
+            if self.draft_model is not None
+            else self._ngram_drafter
+        )
+        assert drafter is not None
+        prefix_length, cache = self.prefix_cache_for([prompt_ids])
+        cache = cache or DynamicCache()
+        if streamer is not None:
+            streamer.put(torch.tensor(prompt_ids))
+        state = grammar.initial if grammar is not None else None
+        generated: list[int] = []
+        feed, drafts = prompt_ids[prefix_length:], []
+        stats = SpeculationStats(sequences=1)
+        while True:
+            logits = self.model(
+                input_ids=torch.tensor([feed + drafts], device=self.model.device),
+                past_key_values=cache,
+                use_cache=True,
+            ).logits[0, len(feed) - 1 :]
+            stats.forward_passes += 1
+            stats.draft_tokens += len(drafts)
+            new_tokens: list[int] = []
+            for position in range(len(drafts) + 1):
+                token_id, state = self._greedy_token(
+                    logits[position],
+                    grammar,
+                    state,
+                    max_new_tokens - len(generated) - len(new_tokens),
+                )
+                new_tokens.append(token_id)
+                accepted = position < len(drafts) and token_id == drafts[position]
+                stats.accepted_tokens += accepted
+                if (
+                    not accepted
+                    or token_id in self.stop_token_ids
+                    or len(generated) + len(new_tokens) >= max_new_tokens
+                ):
+                    break
+            generated += new_tokens
+            if streamer is not None:
+                streamer.put(torch.tensor(new_tokens))
+            if generated[-1] in self.stop_token_ids or len(generated) >= max_new_tokens:
+                break
+
+            # The last token is fed with the next drafts, the rejected ones dropped.
+            cache.crop(len(prompt_ids) + len(generated) - 1)
+            feed = [generated[-1]]
+            drafts = drafter.propose(
+                prompt_ids + generated,
+                min(self.num_draft_tokens, max_new_tokens - len(generated) - 1),
+            )
+            for position, draft in enumerate(drafts):
+                if draft in self.stop_token_ids:
+                    drafts = drafts[: position + 1]
+                    break
+
+        if streamer is not None:
+            streamer.end()
+        stats.generated_tokens = len(generated)
+        with self._speculation_lock:
+            for name, value in stats.__dict__.items():
+                setattr(
+                    self.speculation_stats,
+                    name,
+                    getattr(self.speculation_stats, name) + value,
+                )
+        return prompt_ids + generated
+
+    def stats(self) -> dict[str, Any]:
+        """Serving configuration and speculative decoding counters."""
+        with self._speculation_lock:
+            speculation = self.speculation_stats.as_dict()
+        return {
+            "backend": self.backend.name,
+            "speculative": self.speculative,
+            "speculation": speculation,
+        }
+
+    @torch.no_grad()
+    def score_moods(self, prompt: str) -> dict[str, float]:
+        """Log-likelihood of each catalog mood id as the payload's ``mood_id``.
+
+        The prompt and the payload opening are prefilled once; the candidate ids, with
+        their closing quote, are then scored together in a single batched forward pass
+        over that shared KV cache.
+        """
+        mood_ids = list(self.catalog)
+        rows = self.tokenizer(
+            [f'{prompt}{PAYLOAD_HEAD}{mood_id}"' for mood_id in mood_ids],
+            add_special_tokens=False,
+        )["input_ids"]
+        shared = min(_common_prefix_length(rows[0], ids[:-1]) for ids in rows)
+        prefix_length, cache = self.prefix_cache_for([rows[0][:shared]])
+        cache = cache or DynamicCache()
+        device = self.model.device
+        shared_logits = self.model(
+            input_ids=torch.tensor([rows[0][prefix_length:shared]], device=device),
+            past_key_values=cache,
+            use_cache=True,
+        ).logits[:, -1:, :]
+
+        suffixes = [ids[shared:] for ids in rows]
+        width = max(len(suffix) for suffix in suffixes)
+        candidate_ids = torch.tensor(
+            [
+                suffix + [self.tokenizer.pad_token_id] * (width - len(suffix))
+                for suffix in suffixes
+            ],
+            device=device,
+        )
+        candidate_mask = torch.tensor(
+            [[1] * len(suffix) + [0] * (width - len(suffix)) for suffix in suffixes],
+            device=device,
+        )
+        candidate_logits = self.model(
+            input_ids=candidate_ids,
+            position_ids=torch.arange(shared, shared + width, device=device).expand(
+                len(mood_ids), -1
+            ),
+            past_key_values=DynamicCache.from_legacy_cache(
+                tuple(
+                    (
+                        key.expand(len(mood_ids), -1, -1, -1),
+                        value.expand(len(mood_ids), -1, -1, -1),
+                    )
+                    for key, value in cache.to_legacy_cache()
+                )
+            ),
+            use_cache=True,
+        ).logits
+
+        log_probs = (
+            torch.cat(
+                [
+                    shared_logits.expand(len(mood_ids), -1, -1),
+                    candidate_logits[:, :-1, :],
+                ],
+                dim=1,
+            )
+            .float()
+            .log_softmax(dim=-1)
+        )
+        token_log_probs = log_probs.gather(-1, candidate_ids.unsqueeze(-1)).squeeze(-1)
+        scores = (token_log_probs * candidate_mask).sum(dim=-1).tolist()
+        return dict(zip(mood_ids, scores, strict=True))
+
+    def predict_catalog(
+        self,
+        prompt: str,
+        max_new_tokens: int = DEFAULT_LIGHTING_TOKENS,
+        **kwargs: Any,
+    ) -> str:
+        """Predict a payload by scoring moods and templating catalog fields.
+
+        Only the ``mood_id`` (scored by ``score_moods``) and the lighting cues
+        (generated under the lighting grammar) come from the model; the preview URI,
+        narration and diagnostics are filled in from the catalog. The prediction is
+        formatted like a generated one: prompt, JSON payload, then ``<|end|>``. The
+        lighting array is closed once ``max_new_tokens`` leaves no room for another
+        cue, so it is only empty when the budget cannot hold a single one.
+        """
+        for parameter in ("skip_special_tokens", "constrained_json"):
+            kwargs.pop(parameter, None)
+        scores = self.score_moods(prompt)
+        mood_id = max(scores, key=scores.__getitem__)
+        entry = self.catalog[mood_id]
+        track = {"mood_id": mood_id, "preview_uri": entry.preview_uri}
+
+        # json.dumps without the final brace is the payload up to the lighting value.
+        head = json.dumps({"track": track})[:-1] + ', "lighting": ['
+        prompt_ids = self.tokenizer(prompt + head, add_special_tokens=False)[
+            "input_ids"
+        ]
+        sequence = self._generate_rows(
+            [prompt_ids],
+            self.lighting_grammar,
+            max_new_tokens=max_new_tokens,
+            **kwargs,
         )[0]
+        lighting_text = self.tokenizer.decode(
+            sequence[len(prompt_ids) :], skip_special_tokens=True
+        )
+        try:
+            lighting = json.loads("[" + lighting_text)
+        except json.JSONDecodeError:
+            logger.warning("Truncated lighting for %s: %s", mood_id, lighting_text)
+            lighting = []
 
-    def __call__(self, data: dict[str, Any]) -> dict[str, list[Any]]:
-        """Process inference requests containing image and text prompts."""
+        payload = {
+            "track": track,
+            "lighting": lighting,
+            "narration": entry.narration,
+            "diagnostics": {
+                "valence_hint": entry.valence_hint,
+                "arousal_hint": entry.arousal_hint,
+            },
+        }
+        return prompt + json.dumps(payload, ensure_ascii=True) + END_TOKEN
+
+    def _pad_after_prefix(
+        self, rows: list[list[int]], prefix_length: int
+    ) -> dict[str, torch.Tensor]:
+        """Pad rows to a common width, inserting the padding after the prefix."""
+        width = max(len(ids) for ids in rows)
+        input_ids, attention_mask = [], []
+        for ids in rows:
+            padding = width - len(ids)
+            input_ids.append(
+                ids[:prefix_length]
+                + [self.tokenizer.pad_token_id] * padding
+                + ids[prefix_length:]
+            )
+            attention_mask.append(
+                [1] * prefix_length + [0] * padding + [1] * (len(ids) - prefix_length)
+            )
         return {
-            "predictions": [
-                self.generate(instance["input"], **data.get("parameters", {}))
-                for instance in data["instances"]
-            ]
+            "input_ids": torch.tensor(input_ids, device=self.model.device),
+            "attention_mask": torch.tensor(attention_mask, device=self.model.device),
         }
+
+    def _trim_sequence(self, token_ids: list[int], prompt_length: int) -> list[int]:
+        """Drop the padding appended after a row's first stop token."""
+        generated = token_ids[prompt_length:]
+        for position, token_id in enumerate(generated):
+            if token_id in self.stop_token_ids:
+                generated = generated[: position + 1]
+                break
+        return token_ids[:prompt_length] + generated
+
+    def __call__(self, data: dict[str, Any]) -> dict[str, list[Any]]:
+        """Process inference requests containing image and text prompts."""
+        prompts = [instance["input"] for instance in data["instances"]]
+        parameters = dict(data.get("parameters", {}))
+        mode = parameters.pop("mode", "generate")
+        if mode not in ("generate", "catalog", "stats"):
+            raise ValueError(f"Unknown mode: {mode}")
+        if mode == "stats":
+            return {"predictions": [self.stats()]}
+        if mode == "catalog":
+            return {
+                "predictions": [
+                    self.predict_catalog(prompt, **parameters) for prompt in prompts
+                ]
+            }
+        if self.scheduler is None:
+            return {"predictions": self.generate_batch(prompts, **parameters)}
+
+        futures = [self.scheduler.submit(prompt, parameters) for prompt in prompts]
+        return {"predictions": [future.result() for future in futures]}
@@ -8,6 +8,7 @@ from kfp.dsl import OutputPath, component
     packages_to_install=[
         "pandas>=2.3.2",
         "datasets==4.0.0",
+        "pyarrow",
         "gcsfs",
     ],
 )
@@ -17,28 +18,52 @@ def data_transformation_component(
     train_test_split_ratio: float,
     train_dataset: OutputPath("Dataset"),  # type: ignore
     test_dataset: OutputPath("Dataset"),  # type: ignore
+    chunk_size: int = 0,
+    split_strategy: str = "random",
 ) -> None:
-    """Prepare Synesthetic DJ training pairs and split them for fine-tuning."""
+    """Prepare Synesthetic DJ training pairs and split them for fine-tuning.
+
+    The splits are written as Parquet files holding a ``messages`` column of
+    ``{"role", "content"}`` structs. ``split_strategy`` is one of:
+
+    - ``random``: seeded shuffle of the whole dataset, which must fit in memory.
+    - ``hash``: a row goes to the test split when the hash of its normalized
+      ``user_text`` falls below the split ratio.
+    - ``stratified``: like ``hash``, but rows of a mood are moved to the split that
+      lags behind the ratio for that mood by a whole row, so every mood keeps its
+      share of the test split. Rows repeating a normalized ``user_text`` follow its
+      first occurrence.
+
+    Hash-based strategies run in a single pass and keep the split of existing rows
+    when rows are appended to the samples. With a positive ``chunk_size``, the
+    samples are streamed ``chunk_size`` rows at a time, which requires one of them.
+    """
     import json
     import logging
+    import time
 
+    import numpy as np
     import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
     from datasets import Dataset
 
     logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger(__name__)
     logger.info("Starting data transformation process...")
 
-    logger.info(f"Loading mood samples from {raw_dataset_uri}")
-    samples_df = pd.read_csv(raw_dataset_uri)
     logger.info(f"Loading mood catalog from {mood_catalog_uri}")
     catalog_df = pd.read_csv(mood_catalog_uri)
 
-    dataset_df = samples_df.merge(catalog_df, on="mood_id", how="left")
-    if dataset_df["file_uri"].isna().any():
-        missing = dataset_df[dataset_df["file_uri"].isna()]["mood_id"].unique()
-        raise ValueError(f"Missing audio preview for moods: {missing}")
+    def join_catalog(samples_df: pd.DataFrame) -> pd.DataFrame:
+        """Attach the catalog entry of each sample's mood."""
+        dataset_df = samples_df.merge(catalog_df, on="mood_id", how="left")
+        if dataset_df["file_uri"].isna().any():
+            missing = dataset_df[dataset_df["file_uri"].isna()]["mood_id"].unique()
+            raise ValueError(f"Missing audio preview for moods: {missing}")
+        return dataset_df
 
+    # Keep in sync with MOOD_NARRATIONS and MOOD_METRICS in src/handler.py
     mood_narrations = {
         "bonnehumeur": "Ambiance solaire et detendue pour entretenir cette bonne humeur.",
         "curiosite": "Mouvement malicieux et lumineux pour soutenir ta curiosite.",
@@ -69,53 +94,174 @@ def data_transformation_component(
         "tristesse": {"valence": 0.15, "arousal": 0.3},
     }
 
-    def build_assistant_payload(row: pd.Series) -> str:
-        """Create assistant JSON payload embedding audio and lighting instructions."""
-        lighting = json.loads(row["lighting_script"])
-        narration = mood_narrations.get(
-            row["mood_id"], "Ambiance personnalisee pour ton humeur."
+    # Payloads are assembled from strings encoded once per distinct value, laid out
+    # exactly like json.dumps(payload, ensure_ascii=True) of
+    # {"track": {"mood_id", "preview_uri"}, "lighting", "narration", "diagnostics"}.
+    lighting_json: dict[str, str] = {}
+    payload_heads: dict[tuple[str, str], str] = {}
+    payload_tails: dict[str, str] = {}
+
+    def build_messages(dataset_df: pd.DataFrame) -> list[list[dict[str, str]]]:
+        """Build the user/assistant messages of each row."""
+        for script in dataset_df["lighting_script"].unique():
+            if script not in lighting_json:
+                lighting_json[script] = json.dumps(
+                    json.loads(script), ensure_ascii=True
+                )
+        tracks = list(zip(dataset_df["mood_id"], dataset_df["file_uri"], strict=True))
+        for mood_id, file_uri in set(tracks) - payload_heads.keys():
+            payload_heads[mood_id, file_uri] = (
+                '{"track": {"mood_id": '
+                + json.dumps(mood_id, ensure_ascii=True)
+                + ', "preview_uri": '
+                + json.dumps(file_uri, ensure_ascii=True)
+                + '}, "lighting": '
+            )
+            metrics = mood_metrics.get(mood_id, {"valence": 0.5, "arousal": 0.5})
+            narration = mood_narrations.get(
+                mood_id, "Ambiance personnalisee pour ton humeur."
+            )
+            payload_tails[mood_id] = (
+                ', "narration": '
+                + json.dumps(narration, ensure_ascii=True)
+                + ', "diagnostics": {"valence_hint": '
+                + json.dumps(metrics["valence"])
+                + ', "arousal_hint": '
+                + json.dumps(metrics["arousal"])
+                + "}}"
+            )
+        assistant_payloads = (
+            pd.Series([payload_heads[track] for track in tracks]).to_numpy(object)
+            + dataset_df["lighting_script"].map(lighting_json).to_numpy(object)
+            + dataset_df["mood_id"].map(payload_tails).to_numpy(object)
         )
-        metrics = mood_metrics.get(
-            row["mood_id"], {"valence": 0.5, "arousal": 0.5}
+        return [
+            [
+                {"role": "user", "content": user_text},
+                {"role": "assistant", "content": payload},
+            ]
+            for user_text, payload in zip(
+                dataset_df["user_text"], assistant_payloads, strict=True
+            )
+        ]
+
+    if split_strategy not in ("random", "hash", "stratified"):
+        raise ValueError(f"Unknown split strategy: {split_strategy}")
+    if split_strategy == "random" and chunk_size > 0:
+        raise ValueError("Streamed samples need the hash or stratified split")
+
+    # Split of each normalized text, and rows and test rows of each mood so far.
+    text_splits: dict[int, bool] = {}
+    mood_counts: dict[str, list[int]] = {}
+
+    def text_keys(user_texts: pd.Series) -> np.ndarray:
+        """Hash texts folded to lowercase ASCII words without punctuation."""
+        normalized = (
+            user_texts.str.normalize("NFKD")
+            .str.encode("ascii", errors="ignore")
+            .str.decode("ascii")
+            .str.casefold()
+            .str.replace(r"[^\w\s]", " ", regex=True)
+            .str.split()
+            .str.join(" ")
         )
-        payload = {
-            "track": {
-                "mood_id": row["mood_id"],
-                "preview_uri": row["file_uri"],
-            },
-            "lighting": lighting,
-            "narration": narration,
-            "diagnostics": {
-                "valence_hint": metrics["valence"],
-                "arousal_hint": metrics["arousal"],
-            },
-        }
-        return json.dumps(payload, ensure_ascii=True)
-
-    logger.info("Building structured messages...")
-    dataset_df["messages"] = dataset_df.apply(
-        lambda row: [
-            {"role": "user", "content": row["user_text"]},
-            {"role": "assistant", "content": build_assistant_payload(row)},
-        ],
-        axis=1,
-    )
+        return pd.util.hash_pandas_object(normalized, index=False).to_numpy()
 
-    formatted_dataset = Dataset.from_pandas(
-        dataset_df[["messages"]], preserve_index=False
-    )
-    logger.info(
-        "Splitting dataset into train/test with ratio %.2f",
-        train_test_split_ratio,
-    )
-    split_dataset = formatted_dataset.train_test_split(
-        test_size=train_test_split_ratio, shuffle=True, seed=42
-    )
+    def assign_test(dataset_df: pd.DataFrame) -> np.ndarray:
+        """Return whether each row belongs to the test split."""
+        keys = text_keys(dataset_df["user_text"])
+        in_test = keys / 2.0**64 < train_test_split_ratio
+        if split_strategy == "hash":
+            return in_test
+        for index, (key, mood_id) in enumerate(
+            zip(keys.tolist(), dataset_df["mood_id"].tolist(), strict=True)
+        ):
+            counts = mood_counts.setdefault(mood_id, [0, 0])
+            if key in text_splits:
+                in_test[index] = text_splits[key]
+            else:
+                deficit = train_test_split_ratio * (counts[0] + 1) - counts[1]
+                if deficit >= 1:
+                    in_test[index] = True
+                elif deficit <= -1:
+                    in_test[index] = False
+                text_splits[key] = bool(in_test[index])
+            counts[0] += 1
+            counts[1] += int(in_test[index])
+        return in_test
+
+    start_time = time.perf_counter()
+    num_rows = 0
+    if split_strategy != "random":
+        if chunk_size > 0:
+            logger.info(
+                "Streaming mood samples from %s in chunks of %d rows",
+                raw_dataset_uri,
+                chunk_size,
+            )
+            chunks = pd.read_csv(raw_dataset_uri, chunksize=chunk_size)
+        else:
+            logger.info(f"Loading mood samples from {raw_dataset_uri}")
+            chunks = [pd.read_csv(raw_dataset_uri)]
+        logger.info(
+            "Splitting dataset into train/test with ratio %.2f (%s)",
+            train_test_split_ratio,
+            split_strategy,
+        )
+        schema = pa.schema(
+            [
+                (
+                    "messages",
+                    pa.list_(
+                        pa.struct([("role", pa.string()), ("content", pa.string())])
+                    ),
+                )
+            ]
+        )
+        with (
+            pq.ParquetWriter(train_dataset, schema) as train_writer,
+            pq.ParquetWriter(test_dataset, schema) as test_writer,
+        ):
+            for samples_df in chunks:
+                dataset_df = join_catalog(samples_df)
+                table = pa.Table.from_pydict(
+                    {"messages": build_messages(dataset_df)}, schema=schema
+                )
+                in_test = assign_test(dataset_df)
+                test_writer.write_table(table.filter(pa.array(in_test)))
+                train_writer.write_table(table.filter(pa.array(~in_test)))
+                num_rows += len(dataset_df)
+                logger.info(
+                    "Processed %d rows (%.0f rows/s)",
+                    num_rows,
+                    num_rows / (time.perf_counter() - start_time),
+                )
+        for mood_id, (mood_rows, mood_test_rows) in sorted(mood_counts.items()):
+            logger.info("Mood %s: %d/%d test rows", mood_id, mood_test_rows, mood_rows)
+    else:
+        logger.info(f"Loading mood samples from {raw_dataset_uri}")
+        dataset_df = join_catalog(pd.read_csv(raw_dataset_uri))
+        num_rows = len(dataset_df)
 
-    logger.info("Writing train dataset to %s", train_dataset)
-    split_dataset["train"].to_csv(train_dataset, index=False)
+        logger.info("Building structured messages...")
+        formatted_dataset = Dataset.from_dict({"messages": build_messages(dataset_df)})
+        logger.info(
+            "Splitting dataset into train/test with ratio %.2f",
+            train_test_split_ratio,
+        )
+        split_dataset = formatted_dataset.train_test_split(
+            test_size=train_test_split_ratio, shuffle=True, seed=42
+        )
+
+        logger.info("Writing train dataset to %s", train_dataset)
+        split_dataset["train"].to_parquet(train_dataset)
 
-    logger.info("Writing test dataset to %s", test_dataset)
-    split_dataset["test"].to_csv(test_dataset, index=False)
+        logger.info("Writing test dataset to %s", test_dataset)
+        split_dataset["test"].to_parquet(test_dataset)
 
+    logger.info(
+        "Transformed %d rows at %.0f rows/s",
+        num_rows,
+        num_rows / (time.perf_counter() - start_time),
+    )
     logger.info("Data transformation process completed successfully")
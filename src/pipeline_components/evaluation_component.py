@@ -10,6 +10,7 @@ from kfp.dsl import Dataset, Input, Metrics, Output, OutputPath, component
         "rouge-score>=0.1.2",
         "sacrebleu>=2.5.1",
         "pandas>=2.3.2",
+        "pyarrow",
         "tqdm",
     ],
 )
@@ -57,7 +58,13 @@ def evaluation_component(
         }
 
     logger.info(f"Loading predictions from {predictions.path}")
-    predictions_df = pd.read_csv(predictions.path)
+    with open(predictions.path, "rb") as file:
+        is_parquet = file.read(4) == b"PAR1"
+    predictions_df = (
+        pd.read_parquet(predictions.path)
+        if is_parquet
+        else pd.read_csv(predictions.path)
+    )
 
     metric_definitions = [BleuScore(), RougeScore()]
 
@@ -25,6 +25,7 @@ def fine_tuning_component(
     dataset: Input[Dataset], metrics: Output[Metrics], model: Output[Model]
 ):
     """Fine-tune a Phi-3 model using LoRA and integrate with Vertex AI."""
+    import ast
     import logging
     import time
 
@@ -44,6 +45,21 @@ def fine_tuning_component(
     logger = logging.getLogger(__name__)
     logger.info("Starting fine tuning process...")
 
+    def load_messages_dataset(path: str) -> Dataset:
+        """Load a messages dataset written as Parquet, or as CSV by older runs."""
+        with open(path, "rb") as file:
+            is_parquet = file.read(4) == b"PAR1"
+        if is_parquet:
+            return Dataset.from_parquet(path)  # type: ignore
+        logger.warning("Reading legacy CSV dataset %s", path)
+        return Dataset.from_pandas(
+            pd.read_csv(path).assign(
+                messages=lambda df: df["messages"].apply(
+                    lambda x: ast.literal_eval(x.replace("\n", ","))
+                )
+            )
+        )
+
     hyperparameters = {
         "model_name": "microsoft/Phi-3-mini-4k-instruct",
         "val_split_ratio": 0.2,
@@ -103,13 +119,9 @@ def fine_tuning_component(
     pre_trained_model = get_peft_model(pre_trained_model, lora_config)
 
     logger.info(f"Loading dataset from {dataset.path}...")
-    full_dataset = Dataset.from_pandas(
-        pd.read_csv(dataset.path).assign(
-            messages=lambda df: df["messages"].apply(
-                lambda x: eval(x.replace("\n", ","))
-            )
-        )
-    ).train_test_split(test_size=hyperparameters["val_split_ratio"])
+    full_dataset = load_messages_dataset(dataset.path).train_test_split(
+        test_size=hyperparameters["val_split_ratio"]
+    )
     train_dataset, eval_dataset = (
         full_dataset["train"],
         full_dataset["test"],
@@ -1,12 +1,13 @@
 """Test set inference component for Vertex AI."""
 
-from kfp.dsl import Dataset, Input, Model, OutputPath, component
+from kfp.dsl import Dataset, Input, Metrics, Model, Output, OutputPath, component
 
 
 @component(
     base_image="pytorch/pytorch:2.8.0-cuda12.9-cudnn9-devel",
     packages_to_install=[
-        "google-cloud-storage>=2.10.0",
+        "google-cloud-storage>=2.14.0",
+        "google-crc32c",
         "transformers==4.46.*",
         "peft==0.13.2",
         "datasets==4.0.0",
@@ -18,31 +19,156 @@ def inference_component(
     dataset: Input[Dataset],
     model: Input[Model],
     predictions: OutputPath("Dataset"),  # type: ignore
+    metrics: Output[Metrics],
+    base_model_name: str = "microsoft/Phi-3-mini-4k-instruct",
+    max_new_tokens: int = 64,
+    max_batch_size: int = 32,
+    max_batch_tokens: int = 8192,
 ):
-    """Computes predictions on the test dataset."""
+    """Computes predictions on the test dataset.
+
+    Prompts are sorted by token length and generated in left-padded batches of at
+    most ``max_batch_size`` prompts, whose padded prompt and generated tokens fit in
+    ``max_batch_tokens``. Responses are appended to a checkpoint next to
+    ``predictions`` after each batch, so a preempted run resumes where it stopped.
+    The model runs on the GPU when there is one, otherwise on the CPU. ``model`` is
+    either a LoRA adapter of ``base_model_name`` or a model fused by the export
+    component, recognized by its ``export_manifest.json``.
+    """
+    import ast
+    import base64
+    import json
     import logging
+    import os
     import re
+    import shutil
+    import time
+    from concurrent.futures import ThreadPoolExecutor
     from pathlib import Path
-    from typing import Any
 
+    import google_crc32c
     import pandas as pd
     import torch
+    from datasets import Dataset
     from google.cloud import storage
+    from google.cloud.storage import transfer_manager
     from tqdm import tqdm
     from transformers import AutoModelForCausalLM, AutoTokenizer
 
     logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger(__name__)
 
+    model_cache_dir = os.getenv(
+        "MODEL_CACHE_DIR", os.path.expanduser("~/.cache/synesthetic_dj/models")
+    )
+    download_workers = 8
+    download_chunk_size = 4 * 2**20
+    sliced_download_threshold = 256 * 2**20
+
+    def load_messages_dataset(path: str) -> Dataset:
+        """Load a messages dataset written as Parquet, or as CSV by older runs."""
+        with open(path, "rb") as file:
+            is_parquet = file.read(4) == b"PAR1"
+        if is_parquet:
+            return Dataset.from_parquet(path)  # type: ignore
+        logger.warning("Reading legacy CSV dataset %s", path)
+        return Dataset.from_pandas(
+            pd.read_csv(path).assign(
+                messages=lambda df: df["messages"].apply(
+                    lambda x: ast.literal_eval(x.replace("\n", ","))
+                )
+            )
+        )
+
+    def file_crc32c(path: Path) -> str:
+        """Base64 CRC32C of a file, in the format of the GCS blob metadata."""
+        checksum = google_crc32c.Checksum()
+        with path.open("rb") as file:
+            while chunk := file.read(download_chunk_size):
+                checksum.update(chunk)
+        return base64.b64encode(checksum.digest()).decode()
+
+    def cache_key(blob: storage.Blob) -> str:
+        """Content address of a blob, from its checksum and size.
+
+        The MD5 hash is used when there is one, and the CRC32C for composite objects,
+        which have none.
+        """
+        if blob.md5_hash:
+            return f"{base64.b64decode(blob.md5_hash).hex()}-{blob.size}"
+        if blob.crc32c:
+            return f"{base64.b64decode(blob.crc32c).hex()}-{blob.size}"
+        return f"{blob.etag}-{blob.size}"
+
+    def fetch_blob(blob: storage.Blob, cache_dir: Path) -> Path:
+        """Download a blob into the cache unless it is already there."""
+        cached = cache_dir / cache_key(blob)
+        if cached.exists() and cached.stat().st_size == blob.size:
+            return cached
+
+        partial = cached.with_name(f"{cached.name}.part")
+        if blob.size >= sliced_download_threshold:
+            transfer_manager.download_chunks_concurrently(
+                blob,
+                str(partial),
+                chunk_size=download_chunk_size * 8,
+                max_workers=download_workers,
+                worker_type=transfer_manager.THREAD,
+            )
+        else:
+            # Resume the part left by an interrupted download.
+            offset = partial.stat().st_size if partial.exists() else 0
+            if offset < blob.size:
+                with partial.open("ab") as file:
+                    blob.download_to_file(file, start=offset, checksum=None)
+
+        if partial.stat().st_size != blob.size or (
+            blob.crc32c and file_crc32c(partial) != blob.crc32c
+        ):
+            partial.unlink()
+            raise OSError(f"Corrupted download of gs://{blob.bucket.name}/{blob.name}")
+        os.replace(partial, cached)
+        return cached
+
     def download_model(model_uri: str, local_dir: str):
-        """Download model from GCS to local directory."""
+        """Download model from GCS to local directory.
+
+        Blobs are downloaded concurrently, large ones in parallel slices, and
+        verified against their size and CRC32C. They are kept in ``model_cache_dir``
+        under their checksum, so unchanged files are not downloaded again, and
+        linked into ``local_dir`` following their path under the model prefix.
+        """
         bucket_name, prefix = model_uri.replace("gs://", "").split("/", 1)
+        cache_dir = Path(model_cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
 
-        bucket = storage.Client().get_bucket(bucket_name)
-        for blob in bucket.list_blobs(prefix=prefix):
-            filename = blob.name.split("/")[-1]
-            if filename != "":
-                blob.download_to_filename(f"{local_dir}/{filename}")
+        blobs = [
+            blob
+            for blob in storage.Client().list_blobs(bucket_name, prefix=prefix)
+            if not blob.name.endswith("/")
+        ]
+        # Identical files, e.g. the last trainer checkpoint, are fetched once.
+        unique_blobs = {cache_key(blob): blob for blob in blobs}
+        with ThreadPoolExecutor(download_workers) as executor:
+            cached_files = dict(
+                zip(
+                    unique_blobs,
+                    executor.map(
+                        lambda blob: fetch_blob(blob, cache_dir), unique_blobs.values()
+                    ),
+                    strict=True,
+                )
+            )
+
+        for blob in blobs:
+            target = Path(local_dir) / blob.name[len(prefix) :].lstrip("/")
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.unlink(missing_ok=True)
+            try:
+                os.link(cached_files[cache_key(blob)], target)
+            except OSError:
+                shutil.copyfile(cached_files[cache_key(blob)], target)
+        logger.info(f"Fetched {len(blobs)} model files ({len(unique_blobs)} distinct)")
 
     def build_prompt(tokenizer: AutoTokenizer, sentence: str):
         """Build a prompt from a sentence applying the chat template."""
@@ -54,26 +180,45 @@ def inference_component(
             add_generation_prompt=True,
         )
 
-    def generate(
-        model: AutoModelForCausalLM,
-        tokenizer: AutoTokenizer,
-        prompt: str,
-        **kwargs: Any,
-    ):
-        tokenized_input = tokenizer(
-            prompt,
-            add_special_tokens=False,
-            return_tensors="pt",
-        ).to(model.device)  # type: ignore
-
-        generation_output = model.generate(  # type: ignore
-            **tokenized_input,
-            eos_token_id=tokenizer.eos_token_id,  # type: ignore
-            **kwargs,
-        )
-        return tokenizer.batch_decode(  # type: ignore
-            generation_output, skip_special_tokens=False
-        )[0]
+    def make_batches(lengths: list[int], indices: list[int]) -> list[list[int]]:
+        """Group prompts of similar length within the batch size and token budget."""
+        batches: list[list[int]] = []
+        batch: list[int] = []
+        for index in sorted(indices, key=lambda i: lengths[i], reverse=True):
+            # Prompts come longest first, so the first one sets the padded length.
+            padded_length = lengths[batch[0]] if batch else lengths[index]
+            fits = (len(batch) + 1) * (padded_length + max_new_tokens) <= (
+                max_batch_tokens
+            )
+            if batch and (len(batch) == max_batch_size or not fits):
+                batches.append(batch)
+                batch = []
+            batch.append(index)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def load_checkpoint(path: str) -> dict[int, str]:
+        """Read the responses saved by a previous attempt, if any.
+
+        A last line cut short by the preemption is truncated away, so that new
+        records are appended on a line of their own, and undecodable lines are
+        skipped.
+        """
+        responses: dict[int, str] = {}
+        if os.path.exists(path):
+            with open(path, "r+b") as file:
+                content = file.read()
+                content = content[: content.rfind(b"\n") + 1]
+                file.truncate(len(content))
+            for line in content.decode("utf-8", errors="replace").splitlines():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Skipping undecodable checkpoint line %r", line)
+                    continue
+                responses[record["index"]] = record["response"]
+        return responses
 
     def extract_response(generated_text: str) -> str:
         """Extract the model's response from the generated text."""
@@ -84,43 +229,96 @@ def inference_component(
 
     local_dir = Path("model")
     local_dir.mkdir(parents=True, exist_ok=True)
-    repo_id = "microsoft/Phi-3-mini-4k-instruct"
+    if model.uri.startswith("gs://"):
+        logger.info(f"Downloading model from {model.uri} to {local_dir}...")
+        download_model(model.uri, str(local_dir))
+    else:
+        local_dir = Path(model.path)
 
-    logger.info(f"Downloading model from {model.uri} to {local_dir}...")
-    download_model(model.uri, str(local_dir))
+    # Models fused by the export component ship their tokenizer and a manifest,
+    # adapters from the fine-tuning component are applied on the base model.
+    manifest_path = local_dir / "export_manifest.json"
+    fused = manifest_path.exists()
+    if fused:
+        manifest = json.loads(manifest_path.read_text())
+        logger.info(f"Found {manifest['format']} model of {manifest['base_model']}")
 
-    logger.info("Loading tokenizer and model...")
-    tokenizer = AutoTokenizer.from_pretrained(repo_id)
+    device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    logger.info(f"Loading tokenizer and model on {device}...")
+    tokenizer = AutoTokenizer.from_pretrained(local_dir if fused else base_model_name)
     tokenizer.pad_token = tokenizer.unk_token
     tokenizer.pad_token_id = tokenizer.unk_token_id
-    model_instance = AutoModelForCausalLM.from_pretrained(
-        local_dir, torch_dtype=torch.float16
-    ).eval()
+    tokenizer.padding_side = "left"
+    model_instance = (
+        AutoModelForCausalLM.from_pretrained(
+            local_dir,
+            torch_dtype=torch.float16 if device != "cpu" else torch.float32,
+        )
+        .to(device)
+        .eval()
+    )
 
     logger.info(f"Loading dataset from {dataset.path}...")
-    test_dataset = pd.read_csv(dataset.path).assign(
-        messages=lambda df: df["messages"].apply(lambda x: eval(x.replace("\n", ",")))
+    test_dataset = load_messages_dataset(dataset.path)
+    user_inputs = [messages[0]["content"] for messages in test_dataset["messages"]]
+    references = [messages[1]["content"] for messages in test_dataset["messages"]]
+    input_ids = tokenizer(
+        [build_prompt(tokenizer, user_input) for user_input in user_inputs],
+        add_special_tokens=False,
+    )["input_ids"]
+
+    checkpoint_path = f"{predictions}.checkpoint.jsonl"
+    responses = load_checkpoint(checkpoint_path)
+    if responses:
+        logger.info(f"Resuming from {len(responses)} checkpointed predictions")
+    batches = make_batches(
+        [len(ids) for ids in input_ids],
+        [index for index in range(len(input_ids)) if index not in responses],
     )
 
-    predictions_df = []
-    for _, row in tqdm(test_dataset.iterrows(), total=test_dataset.shape[0]):
-        user_input = row["messages"][0]["content"]
-        reference = row["messages"][1]["content"]
-        response = extract_response(
-            generate(
-                model_instance,
-                tokenizer,
-                build_prompt(tokenizer, user_input),
-                max_new_tokens=64,
-            )
-        )
-        predictions_df.append(
-            {
-                "user_input": user_input,
-                "reference": reference,
-                "response": response,
-            }
-        )
+    num_generated_tokens = 0
+    start_time = time.perf_counter()
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+        for batch in tqdm(batches):
+            inputs = tokenizer.pad(
+                {"input_ids": [input_ids[index] for index in batch]},
+                return_tensors="pt",
+            ).to(device)
+            with torch.inference_mode():
+                outputs = model_instance.generate(  # type: ignore
+                    **inputs,
+                    eos_token_id=tokenizer.eos_token_id,  # type: ignore
+                    pad_token_id=tokenizer.pad_token_id,
+                    max_new_tokens=max_new_tokens,
+                )
+            generated = outputs[:, inputs["input_ids"].shape[1] :]
+            num_generated_tokens += int((generated != tokenizer.pad_token_id).sum())
+            for index, text in zip(
+                batch,
+                tokenizer.batch_decode(outputs, skip_special_tokens=False),
+                strict=True,
+            ):
+                responses[index] = extract_response(text)
+                checkpoint.write(
+                    json.dumps({"index": index, "response": responses[index]}) + "\n"
+                )
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+    elapsed = time.perf_counter() - start_time
+    num_prompts = sum(len(batch) for batch in batches)
 
     logger.info(f"Writing predictions to {predictions}...")
-    pd.DataFrame(predictions_df).to_csv(predictions, index=False)
+    pd.DataFrame(
+        {
+            "user_input": user_inputs,
+            "reference": references,
+            "response": [responses[index] for index in range(len(user_inputs))],
+        }
+    ).to_parquet(predictions, index=False)
+
+    metrics.log_metric("num_prompts", num_prompts)
+    metrics.log_metric("num_batches", len(batches))
+    metrics.log_metric("prompts_per_second", num_prompts / elapsed if elapsed else 0)
+    metrics.log_metric(
+        "tokens_per_second", num_generated_tokens / elapsed if elapsed else 0
+    )
@@ -0,0 +1,121 @@
+"""Model export component merging the LoRA adapter into its base model."""
+
+from kfp.dsl import Input, Metrics, Model, Output, component
+
+
+@component(
+    base_image="pytorch/pytorch:2.8.0-cuda12.9-cudnn9-devel",
+    packages_to_install=[
+        "transformers==4.46.*",
+        "peft==0.13.2",
+        "accelerate==1.10.1",
+        "safetensors==0.6.2",
+        "huggingface-hub==0.34.4",
+        "gcsfs",
+    ],
+)
+def model_export_component(
+    model: Input[Model],
+    merged_model: Output[Model],
+    metrics: Output[Metrics],
+    base_model_name: str = "microsoft/Phi-3-mini-4k-instruct",
+    max_shard_size: str = "2GB",
+):
+    """Merge the fine-tuned LoRA adapter into the base model for serving.
+
+    The adapter saved by the fine-tuning component is loaded on top of the fp16 base
+    model and folded into its weights, so serving runs plain linear layers without
+    adapter injection or LoRA side paths. The fused model is written as sharded
+    safetensors with its tokenizer and an ``export_manifest.json`` that the handler
+    and the inference component detect to load it directly.
+    """
+    import hashlib
+    import json
+    import logging
+    import time
+    from pathlib import Path
+
+    import torch
+    from peft import PeftModel  # pyright: ignore[reportPrivateImportUsage]
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+    manifest_filename = "export_manifest.json"
+    probe_message = "Je me sens d'humeur joyeuse ce soir"
+
+    def file_sha256(path: Path) -> str:
+        """Hex SHA-256 of a file, read in chunks."""
+        digest = hashlib.sha256()
+        with path.open("rb") as file:
+            while chunk := file.read(2**24):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    start_time = time.perf_counter()
+    device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    adapter_dir = Path(model.path)
+    adapter_config = json.loads((adapter_dir / "adapter_config.json").read_text())
+
+    logger.info(f"Loading {base_model_name} in fp16 on {device}...")
+    base_model = AutoModelForCausalLM.from_pretrained(
+        base_model_name, torch_dtype=torch.float16, device_map=device
+    )
+    tokenizer = AutoTokenizer.from_pretrained(base_model_name)
+
+    logger.info(f"Applying adapter from {adapter_dir}...")
+    peft_model = PeftModel.from_pretrained(base_model, str(adapter_dir)).eval()
+    probe = tokenizer.apply_chat_template(  # type: ignore
+        [{"role": "user", "content": probe_message}],
+        add_generation_prompt=True,
+        return_tensors="pt",
+        return_dict=True,
+    ).to(device)
+    with torch.inference_mode():
+        adapter_logits = peft_model(**probe).logits.float()
+
+    logger.info("Merging adapter weights...")
+    fused_model = peft_model.merge_and_unload()
+    with torch.inference_mode():
+        fused_logits = fused_model(**probe).logits.float()
+    # The fused weights are rounded to fp16 once, so logits drift only slightly.
+    max_logit_diff = float((fused_logits - adapter_logits).abs().max())
+    logger.info(f"Largest logit difference after merging: {max_logit_diff:.4f}")
+
+    output_dir = Path(merged_model.path)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    logger.info(f"Saving fused model at {output_dir}...")
+    fused_model.save_pretrained(
+        output_dir, safe_serialization=True, max_shard_size=max_shard_size
+    )
+    tokenizer.save_pretrained(output_dir)
+
+    shards = sorted(output_dir.glob("*.safetensors"))
+    manifest = {
+        "format": "merged-lora",
+        "base_model": base_model_name,
+        "torch_dtype": "float16",
+        "adapter": {
+            key: adapter_config.get(key)
+            for key in ("r", "lora_alpha", "target_modules")
+        },
+        "weights": [
+            {
+                "name": shard.name,
+                "size": shard.stat().st_size,
+                "sha256": file_sha256(shard),
+            }
+            for shard in shards
+        ],
+    }
+    (output_dir / manifest_filename).write_text(json.dumps(manifest, indent=2))
+    export_time = time.perf_counter() - start_time
+
+    logger.info("Logging metrics...")
+    metrics.log_metric("export_time", export_time)
+    metrics.log_metric("num_shards", len(shards))
+    metrics.log_metric(
+        "model_size_bytes", sum(weight["size"] for weight in manifest["weights"])
+    )
+    metrics.log_metric("max_logit_diff", max_logit_diff)
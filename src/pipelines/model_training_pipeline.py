@@ -8,18 +8,23 @@ from src.pipeline_components.data_transformation_component import (
 from src.pipeline_components.evaluation_component import evaluation_component
 from src.pipeline_components.fine_tuning_component import fine_tuning_component
 from src.pipeline_components.inference_component import inference_component
+from src.pipeline_components.model_export_component import model_export_component
 
 
 @pipeline(name="enzo-model-training-pipeline")
 def model_training_pipeline(
     raw_dataset_uri: str,
     mood_catalog_uri: str,
+    transformation_chunk_size: int = 0,
+    split_strategy: str = "stratified",
 ) -> None:
     """Model training pipeline definition."""
     data_transformation_task = data_transformation_component(
         train_test_split_ratio=0.1,
         raw_dataset_uri=raw_dataset_uri,
         mood_catalog_uri=mood_catalog_uri,
+        chunk_size=transformation_chunk_size,
+        split_strategy=split_strategy,
     )  # type: ignore
 
     fine_tuning_task = fine_tuning_component(
@@ -32,9 +37,19 @@ def model_training_pipeline(
         .set_memory_limit("50G")
     )
 
+    model_export_task = model_export_component(  # type: ignore
+        model=fine_tuning_task.outputs["model"]
+    )
+
+    (
+        model_export_task.set_accelerator_type("NVIDIA_TESLA_T4")
+        .set_cpu_limit("16")
+        .set_memory_limit("50G")
+    )
+
     inference_task = inference_component(  # type: ignore
         dataset=data_transformation_task.outputs["test_dataset"],
-        model=fine_tuning_task.outputs["model"],
+        model=model_export_task.outputs["merged_model"],
     )
 
     (
@@ -0,0 +1,89 @@
+"""Tiny models shared by the handler tests, runnable on CPU."""
+
+import json
+from pathlib import Path
+
+import pytest
+import torch
+from tokenizers import Tokenizer, decoders, models
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+from src.handler import EXPORT_MANIFEST_FILENAME
+
+SPECIAL_TOKENS = ["<unk>", "<s>", "</s>", "<|end|>", "<|user|>", "<|assistant|>"]
+CHAT_TEMPLATE = (
+    "{% for message in messages %}<|{{ message['role'] }}|>\n"
+    "{{ message['content'] }}<|end|>\n{% endfor %}"
+    "{% if add_generation_prompt %}<|assistant|>\n{% endif %}"
+)
+
+
+def make_tokenizer() -> PreTrainedTokenizerFast:
+    """Character-level tokenizer with the special tokens of the Phi-3 template."""
+    characters = [chr(code) for code in range(0x20, 0x7F)] + ["\n"]
+    vocab = {token: index for index, token in enumerate(SPECIAL_TOKENS + characters)}
+    backend = Tokenizer(models.BPE(vocab, [], unk_token="<unk>"))
+    backend.decoder = decoders.Fuse()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend,
+        unk_token="<unk>",
+        bos_token="<s>",
+        eos_token="</s>",
+        additional_special_tokens=SPECIAL_TOKENS[3:],
+    )
+    tokenizer.chat_template = CHAT_TEMPLATE
+    return tokenizer
+
+
+def save_tiny_model(directory: Path, seed: int, num_layers: int) -> Path:
+    """Save a randomly initialized causal LM exported like a fused model."""
+    tokenizer = make_tokenizer()
+    torch.manual_seed(seed)
+    model = LlamaForCausalLM(
+        LlamaConfig(
+            vocab_size=len(tokenizer),
+            hidden_size=32,
+            intermediate_size=64,
+            num_hidden_layers=num_layers,
+            num_attention_heads=4,
+            max_position_embeddings=1024,
+            bos_token_id=tokenizer.bos_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+        )
+    )
+    model.save_pretrained(directory)
+    tokenizer.save_pretrained(directory)
+    (directory / EXPORT_MANIFEST_FILENAME).write_text(
+        json.dumps(
+            {"format": "merged-lora", "base_model": "tiny", "torch_dtype": "float32"}
+        )
+    )
+    return directory
+
+
+@pytest.fixture(scope="session")
+def tiny_model_dir(tmp_path_factory: pytest.TempPathFactory) -> str:
+    return str(save_tiny_model(tmp_path_factory.mktemp("model"), 0, num_layers=2))
+
+
+@pytest.fixture(scope="session")
+def tiny_draft_model_dir(tmp_path_factory: pytest.TempPathFactory) -> str:
+    return str(save_tiny_model(tmp_path_factory.mktemp("draft"), 1, num_layers=1))
+
+
+@pytest.fixture(scope="session")
+def prompts() -> list[str]:
+    tokenizer = make_tokenizer()
+    return [
+        tokenizer.apply_chat_template(
+            [{"role": "user", "content": content}],
+            tokenize=False,
+            add_generation_prompt=True,
+        )
+        for content in (
+            "Je me sens bien",
+            "J'ai peur de rater mon examen demain",
+            "Victoire !",
+            "Je repense a mes vacances d'enfance chez ma grand-mere",
+        )
+    ]
@@ -0,0 +1,182 @@
+import json
+import time
+
+import pytest
+
+from src.handler import (
+    _JSON_UNIT_NUMBER,
+    DEFAULT_LIGHTING_TOKENS,
+    END_TOKEN,
+    MAX_JSON_STRING_LENGTH,
+    MAX_LIGHTING_CUES,
+    MOOD_IDS,
+    EndpointHandler,
+    Pattern,
+    TokenGrammar,
+    _Nfa,
+    assistant_payload_pattern,
+)
+from tests.conftest import make_tokenizer
+
+MAX_NEW_TOKENS = 24
+
+
+def reference_generate(handler: EndpointHandler, prompt: str) -> str:
+    """Greedy ``model.generate`` on the unpadded prompt, bypassing the handler."""
+    inputs = handler.tokenizer(
+        prompt,
+        add_special_tokens=False,
+        return_tensors="pt",
+        return_token_type_ids=False,
+    )
+    output = handler.model.generate(
+        **inputs,
+        max_new_tokens=MAX_NEW_TOKENS,
+        do_sample=False,
+        eos_token_id=handler.stop_token_ids,
+        pad_token_id=handler.tokenizer.pad_token_id,
+    )
+    return handler.tokenizer.decode(output[0])
+
+
+@pytest.mark.parametrize("prefix_cache", [True, False])
+def test_generate_batch_matches_unbatched_greedy_generate(
+    tiny_model_dir: str, prompts: list[str], *, prefix_cache: bool
+):
+    handler = EndpointHandler(
+        tiny_model_dir, scheduler="none", prefix_cache=prefix_cache
+    )
+
+    batched = handler.generate_batch(prompts, max_new_tokens=MAX_NEW_TOKENS)
+
+    assert batched == [reference_generate(handler, prompt) for prompt in prompts]
+
+
+@pytest.mark.parametrize("scheduler", ["dynamic", "continuous"])
+def test_schedulers_match_unbatched_greedy_generate(
+    tiny_model_dir: str, prompts: list[str], scheduler: str
+):
+    handler = EndpointHandler(tiny_model_dir, scheduler=scheduler, max_batch_size=3)
+    expected = [
+        handler.generate(prompt, max_new_tokens=MAX_NEW_TOKENS) for prompt in prompts
+    ]
+
+    predictions = handler(
+        {
+            "instances": [{"input": prompt} for prompt in prompts],
+            "parameters": {"max_new_tokens": MAX_NEW_TOKENS},
+        }
+    )["predictions"]
+    handler.scheduler.close()
+
+    assert predictions == expected
+
+
+def test_continuous_batching_admits_requests_while_decoding(
+    tiny_model_dir: str, prompts: list[str]
+):
+    handler = EndpointHandler(tiny_model_dir, scheduler="continuous", max_batch_size=3)
+    engine = handler.scheduler
+    # Longer requests first, so that shorter ones join and leave a running batch.
+    requests = list(zip(prompts, [40, 12, 28, 6], strict=True))
+    expected = [
+        handler.generate(prompt, max_new_tokens=max_new_tokens)
+        for prompt, max_new_tokens in requests
+    ]
+
+    futures = []
+    for prompt, max_new_tokens in requests:
+        futures.append(engine.submit(prompt, {"max_new_tokens": max_new_tokens}))
+        while not (engine._sequences or futures[-1].done()):
+            time.sleep(0.001)
+        time.sleep(0.01)
+    predictions = [future.result() for future in futures]
+    engine.close()
+
+    assert predictions == expected
+
+
+@pytest.mark.parametrize("num_beams", [1, 3])
+def test_constrained_json_closes_within_the_grammar_bounds(
+    tiny_model_dir: str, prompts: list[str], num_beams: int
+):
+    handler = EndpointHandler(tiny_model_dir, scheduler="none")
+
+    for prompt in prompts:
+        output = handler.generate(
+            prompt, max_new_tokens=400, num_beams=num_beams, constrained_json=True
+        )
+
+        assert output.startswith(prompt)
+        assert output.endswith(END_TOKEN)
+        payload = json.loads(output[len(prompt) : -len(END_TOKEN)])
+        assert payload["track"]["mood_id"] in MOOD_IDS
+        assert len(payload["track"]["preview_uri"]) <= MAX_JSON_STRING_LENGTH
+        assert len(payload["narration"]) <= MAX_JSON_STRING_LENGTH
+        assert 1 <= len(payload["lighting"]) <= MAX_LIGHTING_CUES
+        for cue in payload["lighting"]:
+            assert all(0 <= channel <= 255 for channel in cue["rgb"])
+            assert 0 <= cue["duration"] < 1000
+            assert 0 <= cue["intensity"] <= 1
+        assert 0 <= payload["diagnostics"]["valence_hint"] <= 1
+        assert 0 <= payload["diagnostics"]["arousal_hint"] <= 1
+
+
+def matches(pattern: Pattern, text: str) -> bool:
+    nfa = _Nfa(pattern)
+    states = nfa.start
+    for character in text:
+        states = nfa.step(states, character)
+    return nfa.final in states
+
+
+@pytest.mark.parametrize("text", ["0", "0.5", "0.125", "1", "1.0", "1.000"])
+def test_unit_numbers_accept_values_from_zero_to_one(text: str):
+    assert matches(_JSON_UNIT_NUMBER, text)
+
+
+@pytest.mark.parametrize("text", ["1.5", "1.001", "2", "0.1234", "01", "-0.5"])
+def test_unit_numbers_reject_values_out_of_range(text: str):
+    assert not matches(_JSON_UNIT_NUMBER, text)
+
+
+def test_added_tokens_are_never_string_content():
+    tokenizer = make_tokenizer()
+    tokenizer.add_tokens(["<|placeholder|>"])
+    end_token_id = tokenizer.convert_tokens_to_ids(END_TOKEN)
+    grammar = TokenGrammar(tokenizer, assistant_payload_pattern(), end_token_id)
+    state = grammar.initial
+    for token_id in tokenizer(
+        '{"track": {"mood_id": "euphorie", "preview_uri": "', add_special_tokens=False
+    )["input_ids"]:
+        state = grammar.advance(state, token_id)
+
+    allowed = set(grammar.next_token_ids(state).tolist())
+
+    assert tokenizer.convert_tokens_to_ids("a") in allowed
+    assert allowed.isdisjoint(tokenizer.added_tokens_decoder)
+
+
+@pytest.mark.parametrize("max_new_tokens", [DEFAULT_LIGHTING_TOKENS, 64])
+def test_catalog_lighting_closes_within_budget(
+    tiny_model_dir: str, prompts: list[str], max_new_tokens: int
+):
+    handler = EndpointHandler(tiny_model_dir, scheduler="none")
+
+    predictions = handler(
+        {
+            "instances": [{"input": prompt} for prompt in prompts],
+            "parameters": {"mode": "catalog", "max_new_tokens": max_new_tokens},
+        }
+    )["predictions"]
+
+    for prompt, prediction in zip(prompts, predictions, strict=True):
+        payload = json.loads(prediction[len(prompt) : -len(END_TOKEN)])
+        assert payload["lighting"]
+
+
+def test_unknown_modes_are_rejected(tiny_model_dir: str, prompts: list[str]):
+    handler = EndpointHandler(tiny_model_dir, scheduler="none")
+
+    with pytest.raises(ValueError, match="Unknown mode"):
+        handler({"instances": [{"input": prompts[0]}], "parameters": {"mode": "x"}})
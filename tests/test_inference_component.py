@@ -0,0 +1,140 @@
+import base64
+import hashlib
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+dsl = pytest.importorskip("kfp.dsl")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("datasets")
+storage = pytest.importorskip("google.cloud.storage")
+google_crc32c = pytest.importorskip("google_crc32c")
+
+from src.pipeline_components.inference_component import (  # noqa: E402
+    inference_component,
+)
+
+SENTENCES = ["Je me sens bien", "Victoire !", "J'ai peur de rater mon examen"]
+PREFIX = "models/run"
+
+
+class FakeBlob:
+    """Blob of a fake bucket recording the offsets it is downloaded from."""
+
+    def __init__(self, name: str, data: bytes) -> None:
+        self.name = name
+        self.data = data
+        self.size = len(data)
+        self.bucket = SimpleNamespace(name="bucket")
+        self.etag = "etag"
+        self.crc32c = base64.b64encode(google_crc32c.Checksum(data).digest()).decode()
+        self.md5_hash = base64.b64encode(hashlib.md5(data).digest()).decode()
+        self.downloads: list[int] = []
+
+    def download_to_file(self, file, start: int = 0, checksum=None) -> None:
+        self.downloads.append(start)
+        file.write(self.data[start:])
+
+    @property
+    def cache_name(self) -> str:
+        return f"{base64.b64decode(self.md5_hash).hex()}-{self.size}"
+
+
+def model_blobs(model_dir: str) -> list[FakeBlob]:
+    blobs = [
+        FakeBlob(f"{PREFIX}/{path.name}", path.read_bytes())
+        for path in Path(model_dir).iterdir()
+    ]
+    blobs.append(FakeBlob(f"{PREFIX}/checkpoint-1/trainer_state.json", b"{}"))
+    return blobs
+
+
+def run_component(tmp_path: Path, model: "dsl.Model") -> Path:
+    dataset_path = tmp_path / "test.parquet"
+    pd.DataFrame(
+        {
+            "messages": [
+                [
+                    {"role": "user", "content": sentence},
+                    {"role": "assistant", "content": "{}"},
+                ]
+                for sentence in SENTENCES
+            ]
+        }
+    ).to_parquet(dataset_path)
+    predictions = tmp_path / "predictions.parquet"
+    inference_component.python_func(
+        dataset=dsl.Dataset(uri=str(dataset_path)),
+        model=model,
+        predictions=str(predictions),
+        metrics=dsl.Metrics(uri=str(tmp_path / "metrics")),
+        max_new_tokens=8,
+    )
+    return predictions
+
+
+@pytest.fixture
+def bucket(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    """Serve blobs from a fake GCS client, caching them under ``tmp_path``."""
+    blobs: list[FakeBlob] = []
+    client = SimpleNamespace(
+        list_blobs=lambda bucket_name, prefix: [
+            blob for blob in blobs if blob.name.startswith(prefix)
+        ]
+    )
+    monkeypatch.setattr(storage, "Client", lambda: client)
+    monkeypatch.setenv("MODEL_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.chdir(tmp_path)
+    return blobs
+
+
+def test_resumes_from_a_checkpoint_cut_short(tiny_model_dir: str, tmp_path: Path):
+    checkpoint = tmp_path / "predictions.parquet.checkpoint.jsonl"
+    checkpoint.write_text(
+        json.dumps({"index": 1, "response": "checkpointed"})
+        + "\nnot json\n"
+        + '{"index": 2, "resp'
+    )
+
+    predictions = run_component(tmp_path, dsl.Model(uri=tiny_model_dir))
+
+    responses = pd.read_parquet(predictions)["response"].tolist()
+    assert len(responses) == len(SENTENCES)
+    assert responses[1] == "checkpointed"
+    records = [json.loads(line) for line in checkpoint.read_text().splitlines()[2:]]
+    assert sorted(record["index"] for record in records) == [0, 2]
+
+
+def test_downloads_model_through_the_cache(
+    tiny_model_dir: str, tmp_path: Path, bucket: list[FakeBlob]
+):
+    bucket.extend(model_blobs(tiny_model_dir))
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    cached, resumed, *downloaded = bucket
+    (cache_dir / cached.cache_name).write_bytes(cached.data)
+    (cache_dir / f"{resumed.cache_name}.part").write_bytes(resumed.data[:10])
+
+    run_component(tmp_path, dsl.Model(uri=f"gs://bucket/{PREFIX}"))
+
+    assert cached.downloads == []
+    assert resumed.downloads == [10]
+    assert all(blob.downloads == [0] for blob in downloaded)
+    for blob in bucket:
+        local_path = tmp_path / "model" / blob.name.removeprefix(f"{PREFIX}/")
+        assert local_path.read_bytes() == blob.data
+    assert (tmp_path / "model" / "checkpoint-1" / "trainer_state.json").exists()
+
+
+def test_rejects_corrupted_downloads(
+    tiny_model_dir: str, tmp_path: Path, bucket: list[FakeBlob]
+):
+    bucket.extend(model_blobs(tiny_model_dir))
+    bucket[0].data = b"x" + bucket[0].data[1:]
+
+    with pytest.raises(OSError, match="Corrupted download"):
+        run_component(tmp_path, dsl.Model(uri=f"gs://bucket/{PREFIX}"))
+
+    assert not list((tmp_path / "cache").glob("*.part"))
@@ -0,0 +1,62 @@
+import json
+import re
+
+import pytest
+
+from src.app.lighting import LightingRenderer, LightingScript
+
+LIGHTING = [
+    {"rgb": [255, 10, 0], "duration": 4, "intensity": 0.5},
+    {"rgb": [0, 0, 255], "duration": 2.5},
+]
+
+
+def stylesheet_filename(html: str) -> str:
+    return re.findall(r"href='/lighting/([^']+)'", html)[-1]
+
+
+def test_stylesheet_is_compiled_again_from_its_url():
+    renderer = LightingRenderer()
+    filename = stylesheet_filename(renderer.render(LIGHTING))
+
+    assert LightingRenderer(max_palettes=0).stylesheet(filename) == (
+        renderer.stylesheet(filename)
+    )
+
+
+def test_stylesheet_rejects_urls_not_matching_their_cues():
+    renderer = LightingRenderer()
+    name, token, _ = stylesheet_filename(renderer.render(LIGHTING)).split(".")
+
+    assert renderer.stylesheet(f"synDj0000000000000000.{token}.css") is None
+    assert renderer.stylesheet(f"{name}.{token[:-2]}.css") is None
+    assert renderer.stylesheet(f"{name}.css") is None
+
+
+def test_script_round_trips_through_json():
+    lighting = LightingScript.from_json(LIGHTING).to_json()
+
+    assert lighting == LIGHTING
+    assert json.loads(json.dumps(lighting)) == LIGHTING
+
+
+@pytest.mark.parametrize(
+    "cue",
+    [
+        {"rgb": [1.7, 0, 0], "duration": 1},
+        {"rgb": [True, 0, 0], "duration": 1},
+        {"rgb": [256, 0, 0], "duration": 1},
+        {"rgb": [0, 0], "duration": 1},
+        {"rgb": [0, 0, 0], "duration": "2"},
+        {"rgb": [0, 0, 0], "duration": False},
+        {"rgb": [0, 0, 0], "duration": 1, "intensity": "0.5"},
+        {"rgb": [0, 0, 0]},
+    ],
+)
+def test_from_json_rejects_invalid_cues(cue: dict):
+    with pytest.raises(ValueError, match="Invalid lighting"):
+        LightingScript.from_json([cue])
+
+
+def test_render_skips_invalid_lighting():
+    assert LightingRenderer().render([{"rgb": [1.7, 0, 0], "duration": 1}]) == ""
@@ -0,0 +1,33 @@
+import pytest
+
+from src.handler import EndpointHandler
+
+MAX_NEW_TOKENS = 48
+
+
+@pytest.mark.parametrize("speculative", ["ngram", "draft"])
+@pytest.mark.parametrize("constrained_json", [False, True])
+def test_speculative_decoding_matches_greedy_generate(
+    tiny_model_dir: str,
+    tiny_draft_model_dir: str,
+    prompts: list[str],
+    speculative: str,
+    *,
+    constrained_json: bool,
+):
+    handler = EndpointHandler(
+        tiny_model_dir,
+        scheduler="none",
+        speculative=speculative,
+        draft_model=tiny_draft_model_dir,
+    )
+    parameters = {
+        "max_new_tokens": MAX_NEW_TOKENS,
+        "constrained_json": constrained_json,
+    }
+
+    for prompt in prompts:
+        assert handler.generate(prompt, **parameters) == handler.generate(
+            prompt, speculative=False, **parameters
+        )
+    assert handler.stats()["speculation"]["forward_passes"] > 0